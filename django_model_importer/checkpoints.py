@@ -0,0 +1,65 @@
+from __future__ import absolute_import, unicode_literals
+
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class FileCheckpoint(object):
+    """
+    Progress of an import saved in a JSON sidecar file, by default next to the imported file.
+
+    The checkpoint stores the next row to import and the counters of the committed rows,
+    it is ignored when the size or the modification time of the imported file changed
+    (or file_signature, for files that are not on disk).
+    """
+    suffix = ".checkpoint.json"
+
+    def __init__(self, file_path, checkpoint_path=None, file_signature=None):
+        self.file_path = str(file_path)
+        self.checkpoint_path = str(checkpoint_path or self.file_path + self.suffix)
+        self.file_signature = file_signature
+
+    def get_file_signature(self):
+        if self.file_signature is not None:
+            return self.file_signature
+        stat = os.stat(self.file_path)
+        return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+    def load(self):
+        """ Return the saved state, None when there is no valid checkpoint"""
+        try:
+            with open(self.checkpoint_path) as checkpoint_file:
+                state = json.load(checkpoint_file)
+        except FileNotFoundError:
+            return None
+        except ValueError as ex:
+            logger.warning("Ignoring unreadable checkpoint {0}: {1}".format(self.checkpoint_path, ex))
+            return None
+        if state.get('file') != self.get_file_signature():
+            logger.warning("Ignoring checkpoint {0}, {1} changed since it was written".format(
+                self.checkpoint_path, self.file_path))
+            return None
+        return state
+
+    def save(self, next_row, rows, imported, errors):
+        state = {
+            'file': self.get_file_signature(),
+            'next_row': next_row,
+            'rows': rows,
+            'imported': imported,
+            'errors': errors,
+        }
+        # Written aside and renamed so a crash never leaves a truncated checkpoint
+        temporary_path = self.checkpoint_path + ".tmp"
+        with open(temporary_path, "w") as checkpoint_file:
+            json.dump(state, checkpoint_file)
+        os.replace(temporary_path, self.checkpoint_path)
+
+    def clear(self):
+        try:
+            os.remove(self.checkpoint_path)
+        except FileNotFoundError:
+            pass
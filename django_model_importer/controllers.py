@@ -1,26 +1,46 @@
 from __future__ import absolute_import, print_function, unicode_literals
 
+import datetime
+import hashlib
+import json
 import logging
-from pathlib import Path
+from collections import defaultdict, namedtuple
+from contextlib import ExitStack
+from itertools import islice
 
 from dateutil.parser import parse
 from django.conf import settings
-from django.core.exceptions import ObjectDoesNotExist, ImproperlyConfigured
+from django.core.exceptions import FieldDoesNotExist, ObjectDoesNotExist, ImproperlyConfigured, ValidationError
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, router, transaction
 from django.db.models import fields
+from django.db.models.constants import LOOKUP_SEP
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
+from . import signals
+from .checkpoints import FileCheckpoint
+from .converters import InvalidValue, convert_datetime_series, convert_numeric_series
+from .countries import get_country_index
+from .errors import ErrorCollector, RejectsWriter
+from .inputs import get_import_file
+from .metrics import ImportMetrics
+from .readers import COLUMNAR_EXTENSIONS, iter_columnar_batches, iter_excel_rows, skip_data_frame_rows
+from .resolvers import ImportIdIndex, RelatedObjectResolver, filter_in_chunks
+from .tracing import RowTracer
+
 try:
-    from django_countries import countries as COUNTRY_CHOICES
     from django_countries.fields import Country, CountryField
 except ImportError as ex:
     Country = CountryField = None
-    COUNTRY_CHOICES = []
 import pandas as pd
 import numpy as np
 
 
 logger = logging.getLogger(__name__)
 
+# Compiled dispatch of a file column on a model field, see ModelCSVImporter.get_field_plan()
+ColumnPlan = namedtuple('ColumnPlan', ['column_name', 'field_name', 'model_field', 'kind', 'handler'])
+
 
 class PandasCSVImporter(object):
     delimiter = ";"
@@ -29,10 +49,91 @@ class PandasCSVImporter(object):
     expected_cols = 1
     logger = logger
     from_row = 1
+    # Number of rows collected before flush_batch() is called, None disables batching
+    batch_size = None
+    # Number of rows read from the file at once, None reads the whole file
+    chunk_size = None
+    # Storage of the imported file names, e.g. default_storage, None reads them from disk
+    storage = None
+    # Stream XLSX files with openpyxl in read-only mode when chunk_size is set
+    stream_excel = True
+    # read_csv engine: None (C engine), "python" or "pyarrow" (multithreaded, read at once)
+    csv_engine = None
+    # dtype of specific columns, e.g. {"Amount": "float64"}, the others are read as str
+    column_dtypes = {}
+    na_values = [
+        "-1.#IND", "1.#QNAN", "1.#IND", "-1.#QNAN",
+        "#N/A N/A", "#N/A", "N/A", "n/a",
+        # "NA", 'ND',
+        "#NA", "NULL", "null", "NaN", "-NaN", "nan", "-nan",
+        "", '-', '#N/D', 'nd',
+    ]
+
+    # Number of worker processes, each importing its chunks in its own transaction
+    workers = None
+    # multiprocessing start method of the workers ("fork", "spawn", "forkserver"), None for the default one
+    workers_start_method = None
+    # None (autocommit), "file", "batch" or "row": scope of the import transactions.
+    # Inside "file" and "batch" transactions every row gets a savepoint.
+    transaction_mode = None
+    transaction_modes = (None, "file", "batch", "row")
+    # Return per-phase timings and query counts in the 'metrics' entry of the result
+    collect_metrics = False
+    # Callable receiving (name, value) of every metric, e.g. a MetricsCollector
+    metrics_sink = None
+    _metrics = None
+    # DEBUG trace of one row every trace_rows_every and/or at most trace_rows_per_second rows a second
+    trace_rows_every = None
+    trace_rows_per_second = None
+    _row_tracer = None
+    # True (sidecar file next to the imported one) or the path of a checkpoint file
+    # saved after every committed batch, a restarted import resumes from it
+    checkpoint = None
+    # Parse, convert, resolve and validate the rows without writing anything,
+    # the errors of the rows are returned in the 'row_errors' entry of the result
+    dry_run = False
+    _dry_run = False
+    # Report the exceptions raised by a row (rolled back to its savepoint inside a transaction)
+    # and go on with the next one, otherwise they abort the import
+    continue_on_error = False
+    # Return the errors of the rows in the 'row_errors' entry of the result, an ErrorCollector
+    # keeping max_errors_in_memory errors in memory before spilling them to a file
+    collect_errors = False
+    max_errors_in_memory = 1000
+    # File all the collected errors are written to, CSV when it ends with .csv, JSON lines otherwise
+    errors_file = None
+    # CSV file of the failing rows, with the header and the delimiter of the imported files
+    rejects_file = None
+    _errors = None
+    _rejects = None
+    _current_row = None
 
     def __init__(self, **kwargs):
+        # Kept to build the same importer in the worker processes
+        self.init_kwargs = kwargs
         self.delimiter = kwargs.get('delimiter', self.delimiter)
         self.logger = kwargs.get('logger', self.logger)
+        self.batch_size = kwargs.get('batch_size', self.batch_size)
+        self.chunk_size = kwargs.get('chunk_size', self.chunk_size)
+        self.csv_engine = kwargs.get('csv_engine', self.csv_engine)
+        self.storage = kwargs.get('storage', self.storage)
+        self.workers = kwargs.get('workers', self.workers)
+        self.workers_start_method = kwargs.get('workers_start_method', self.workers_start_method)
+        self.transaction_mode = kwargs.get('transaction_mode', self.transaction_mode)
+        self.collect_metrics = kwargs.get('collect_metrics', self.collect_metrics)
+        self.metrics_sink = kwargs.get('metrics_sink', self.metrics_sink)
+        self.trace_rows_every = kwargs.get('trace_rows_every', self.trace_rows_every)
+        self.trace_rows_per_second = kwargs.get('trace_rows_per_second', self.trace_rows_per_second)
+        self.from_row = kwargs.get('from_row', self.from_row)
+        self.checkpoint = kwargs.get('checkpoint', self.checkpoint)
+        self.dry_run = kwargs.get('dry_run', self.dry_run)
+        self.continue_on_error = kwargs.get('continue_on_error', self.continue_on_error)
+        self.collect_errors = kwargs.get('collect_errors', self.collect_errors)
+        self.errors_file = kwargs.get('errors_file', self.errors_file)
+        self.rejects_file = kwargs.get('rejects_file', self.rejects_file)
+        if self.transaction_mode not in self.transaction_modes:
+            raise ImproperlyConfigured("Invalid transaction_mode {0!r}, choose one of {1}".format(
+                self.transaction_mode, self.transaction_modes))
 
     # def import_csv(self, file_path, **kwargs):
     #     logger.debug("importing csv {0}".format(file_path))
@@ -53,71 +154,557 @@ class PandasCSVImporter(object):
     #                        "".format(len(data_dict),error_number)))
     #     return {'rows': len(data_dict), 'imported': imported_number, 'errors': error_number}
 
-    def get_rows_as_data_frame(self, file_path, sheet_name=0):
-        file_extension = Path(file_path).suffix[1:].lower()
+    def get_import_file(self, file_path):
+        """ Wrap a path, a file object or a storage name in an ImportFile"""
+        return get_import_file(file_path, storage=self.storage)
+
+    def get_file_extension(self, file_path):
+        return self.get_import_file(file_path).file_extension
+
+    def get_csv_engine(self, chunk_size=None):
+        if self.csv_engine == "pyarrow" and chunk_size:
+            # pyarrow parses the whole file at once
+            logger.debug("chunk_size is not supported by the pyarrow engine, using the C engine")
+            return None
+        return self.csv_engine
+
+    def get_usecols(self, engine=None, header=None):
+        """
+        Columns read from the file, a list or a callable (not with pyarrow), None reads them all.
+        header is the list of the columns of the file when they are known, pyarrow fails on missing ones.
+        """
+        return None
+
+    def read_csv_header(self, import_file):
+        """ Column names of a CSV file, None when it cannot be read twice"""
+        if not import_file.can_reopen:
+            return None
+        with import_file.open() as source:
+            return list(pd.read_csv(source, delimiter=self.delimiter, quotechar=self.quotechar, nrows=0).columns)
+
+    def get_column_dtypes(self):
+        return dict(self.column_dtypes)
+
+    def get_dtype(self, usecols=None):
+        """ dtype argument of the reader, every column is read as str unless get_column_dtypes() says otherwise"""
+        column_dtypes = self.get_column_dtypes()
+        if not column_dtypes:
+            return str
+        if isinstance(usecols, (list, tuple)):
+            return {column_name: column_dtypes.get(column_name, str) for column_name in usecols}
+        return defaultdict(lambda: str, column_dtypes)
+
+    def get_read_kwargs(self, file_extension, sheet_name=0, chunk_size=None, import_file=None):
+        """ Keyword arguments of the pandas reader of import_file"""
         if file_extension in ["xls", "xlsx"]:
-            return pd.read_excel(
-                file_path,
-                sheet_name=sheet_name,
-                dtype=str,
-                na_values=[
-                    "-1.#IND", "1.#QNAN", "1.#IND", "-1.#QNAN",
-                    "#N/A N/A", "#N/A", "N/A", "n/a",
-                    # "NA", 'ND',
-                    "#NA", "NULL", "null", "NaN", "-NaN", "nan", "-nan",
-                    "", '-', '#N/D', 'nd',
-                ],
-                keep_default_na=False
-            )
+            return {
+                'sheet_name': sheet_name,
+                'dtype': str,
+                'na_values': self.na_values,
+                'keep_default_na': False,
+                'usecols': self.get_usecols(),
+            }
         elif file_extension == "csv":
-            return pd.read_csv(
-                file_path, delimiter=self.delimiter, sep=self.quotechar,
-                dtype=str, na_values=[
-                    "-1.#IND", "1.#QNAN", "1.#IND", "-1.#QNAN",
-                    "#N/A N/A", "#N/A", "N/A", "n/a",
-                    # "NA", 'ND',
-                    "#NA", "NULL", "null", "NaN", "-NaN", "nan", "-nan",
-                    "", '-', '#N/D', 'nd',
-                ],
-                keep_default_na=False)
+            engine = self.get_csv_engine(chunk_size=chunk_size)
+            usecols = self.get_usecols(engine=engine)
+            if engine == "pyarrow" and usecols is not None:
+                # Only the columns of the header, the C engine takes a callable instead when it cannot be read
+                header = self.read_csv_header(import_file) if import_file is not None else None
+                if header is None:
+                    engine = None
+                usecols = self.get_usecols(engine=engine, header=header)
+            read_kwargs = {
+                'delimiter': self.delimiter,
+                'quotechar': self.quotechar,
+                'dtype': self.get_dtype(usecols),
+                'na_values': self.na_values,
+                'keep_default_na': False,
+                'usecols': usecols,
+            }
+            if engine:
+                read_kwargs['engine'] = engine
+            return read_kwargs
+        raise NotImplementedError(f"get_rows_as_data_frame is not implemented yet "
+                                  f"for file extension '{file_extension}'")
+
+    def get_rows_as_data_frame(self, file_path, sheet_name=0, from_row=1):
+        """ from_row is the first data row read, counted without the header and the blank lines"""
+        import_file = self.get_import_file(file_path)
+        file_extension = import_file.file_extension
+        if file_extension in COLUMNAR_EXTENSIONS:
+            return pd.concat(list(self.get_columnar_data_frames(import_file, file_extension, from_row=from_row)),
+                             ignore_index=True)
+        read_kwargs = self.get_read_kwargs(file_extension, sheet_name=sheet_name, import_file=import_file)
+        with import_file.open() as source:
+            if file_extension in ["xls", "xlsx"]:
+                data_frame = pd.read_excel(source, **read_kwargs)
+            else:
+                data_frame = pd.read_csv(source, **read_kwargs)
+        if from_row > 1:
+            data_frame = data_frame.iloc[from_row - 1:].reset_index(drop=True)
+        return data_frame
+
+    def get_data_frames(self, file_path, sheet_name=0, chunk_size=None, from_row=1):
+        """
+        Yield the file as DataFrames of chunk_size rows (a single one without chunk_size).
+        CSV and XLSX files are read incrementally, XLS workbooks are loaded once and sliced,
+        Parquet files are streamed one row group at a time without chunk_size.
+        """
+        import_file = self.get_import_file(file_path)
+        file_extension = import_file.file_extension
+        if file_extension in COLUMNAR_EXTENSIONS:
+            for data_frame in self.get_columnar_data_frames(import_file, file_extension, chunk_size=chunk_size,
+                                                            from_row=from_row):
+                yield data_frame
+        elif not chunk_size:
+            yield self.get_rows_as_data_frame(import_file, sheet_name=sheet_name, from_row=from_row)
+        elif file_extension == "csv":
+            with import_file.open() as source:
+                reader = pd.read_csv(source, chunksize=chunk_size, **self.get_read_kwargs(
+                    file_extension, sheet_name=sheet_name, chunk_size=chunk_size, import_file=import_file))
+                try:
+                    for data_frame in skip_data_frame_rows(reader, from_row - 1):
+                        yield data_frame
+                finally:
+                    reader.close()
+        elif file_extension == "xlsx" and self.stream_excel:
+            for data_frame in self.get_excel_data_frames(import_file, sheet_name=sheet_name, chunk_size=chunk_size,
+                                                         from_row=from_row):
+                yield data_frame
+        else:
+            data_frame = self.get_rows_as_data_frame(import_file, sheet_name=sheet_name, from_row=from_row)
+            for start in range(0, len(data_frame), chunk_size):
+                yield data_frame.iloc[start:start + chunk_size]
+
+    def get_excel_data_frames(self, file_path, sheet_name=0, chunk_size=None, from_row=1):
+        """
+        Yield DataFrames of chunk_size rows of an XLSX sheet read in read-only mode,
+        with the same str cells and na_values of read_excel
+        """
+        with self.get_import_file(file_path).open() as source:
+            for data_frame in self._iter_excel_data_frames(source, sheet_name, chunk_size, from_row):
+                yield data_frame
+
+    def _iter_excel_data_frames(self, source, sheet_name, chunk_size, from_row):
+        rows = iter_excel_rows(source, sheet_name=sheet_name)
+        header = [str(column_name) if column_name is not None else "Unnamed: {0}".format(index)
+                  for index, column_name in enumerate(next(rows))]
+        usecols = self.get_usecols()
+        if usecols is None:
+            column_indexes = list(range(len(header)))
+        elif callable(usecols):
+            column_indexes = [index for index, column_name in enumerate(header) if usecols(column_name)]
         else:
-            raise NotImplementedError(f"get_rows_as_data_frame is not implemented yet "
-                                      f"for file extension '{file_extension}'")
+            column_indexes = [index for index, column_name in enumerate(header) if column_name in usecols]
+        columns = [header[index] for index in column_indexes]
+        na_values = set(self.na_values)
+
+        def get_cell(row, index):
+            value = row[index] if index < len(row) else None
+            if value is None:
+                return np.nan
+            value = str(value)
+            return np.nan if value in na_values else value
+
+        chunk = []
+        for row in islice(rows, from_row - 1, None):
+            chunk.append([get_cell(row, index) for index in column_indexes])
+            if len(chunk) == chunk_size:
+                yield pd.DataFrame(chunk, columns=columns, dtype=object)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=columns, dtype=object)
+
+    def get_columnar_data_frames(self, file_path, file_extension, chunk_size=None, from_row=1):
+        """ Yield the DataFrames of a memory mapped Parquet, Feather or Arrow IPC file, keeping its types"""
+        import_file = self.get_import_file(file_path)
+        with import_file.open() as source:
+            for batch in iter_columnar_batches(
+                    source, file_extension, columns=self.get_usecols(engine="pyarrow"), chunk_size=chunk_size,
+                    skip_rows=from_row - 1, memory_map=import_file.is_local_path):
+                yield batch.to_pandas()
 
     def get_data_frame_as_dict(self, data_frame):
         # data_frame.columns = [self.db_mapping.get(column_name, column_name) for column_name in data_frame.columns]
-        logger.info(f"data_frame : \n {data_frame}")
+        logger.debug("data_frame of %s rows and %s columns", *data_frame.shape)
+        categorical_columns = [column_name for column_name, dtype in data_frame.dtypes.items()
+                               if isinstance(dtype, pd.CategoricalDtype)]
+        if categorical_columns:
+            # Empty cells can not be replaced in a categorical column
+            data_frame = data_frame.astype({column_name: object for column_name in categorical_columns})
         data_dict = data_frame.replace({np.nan: ""}).to_dict('records')
         return data_dict
 
+    def iter_batches(self, file_path, sheet_name=0, batch_size=None, chunk_size=None, from_row=1):
+        """
+        Yield lists of row dicts of batch_size rows, or one list per chunk
+        (the whole file when neither batch_size nor chunk_size are set)
+        """
+        pending_rows = []
+        data_frames = iter(self.get_data_frames(file_path, sheet_name=sheet_name, chunk_size=chunk_size,
+                                                from_row=from_row))
+        chunk_number = 0
+        while True:
+            with self.measure("read"):
+                data_frame = next(data_frames, None)
+            if data_frame is None:
+                break
+            if chunk_number == 0:
+                self.validate_columns(list(data_frame.columns))
+            chunk_number += 1
+            with self.measure("convert"):
+                data_frame = self.convert_data_frame(data_frame)
+            with self.measure("read"):
+                rows = self.get_data_frame_as_dict(data_frame)
+            if not batch_size:
+                if rows:
+                    yield rows
+                continue
+            pending_rows.extend(rows)
+            # Slice the batches at an offset and keep only the rest, each row is copied once
+            offset = 0
+            while len(pending_rows) - offset >= batch_size:
+                yield pending_rows[offset:offset + batch_size]
+                offset += batch_size
+            pending_rows = pending_rows[offset:]
+        if pending_rows:
+            yield pending_rows
+
     def validate_columns(self, columns):
         """ Use this method to validate file structure"""
         logger.debug("Columns : {}".format(columns))
 
+    def convert_data_frame(self, data_frame):
+        """ Use this method to convert whole columns before the rows are imported"""
+        return data_frame
+
+    def report_progress(self, rows, imported, errors):
+        """ Called after each batch with the running counters"""
+        self.logger.debug("Processed {0} rows, {1} imported, {2} errors".format(rows, imported, errors))
+
     def import_csv(self, file_path, **kwargs):
+        for event in self.iter_import(file_path, **kwargs):
+            pass
+        return event['result']
+
+    async def aimport_csv(self, file_path, **kwargs):
+        """
+        Async generator of the events of iter_import(). Every step (reading a batch and
+        writing it) runs in the thread used by Django for the sync code of the request,
+        so the event loop is free while the rows are imported. It needs asgiref >= 3.3 (Django >= 3.2).
+        """
+        try:
+            from asgiref.sync import sync_to_async
+        except ImportError:
+            raise ImproperlyConfigured("asgiref is required to import files asynchronously")
+        events = self.iter_import(file_path, **kwargs)
+        next_event = sync_to_async(next, thread_sensitive=True)
+        try:
+            while True:
+                event = await next_event(events, None)
+                if event is None:
+                    break
+                yield event
+        finally:
+            # Exits the import transactions in the thread that opened them
+            await sync_to_async(events.close, thread_sensitive=True)()
+
+    def iter_import(self, file_path, **kwargs):
+        """
+        Import file_path yielding a {'event': 'progress', 'rows', 'imported', 'errors'} dict
+        after each batch and a final {'event': 'finished', 'result'} one.
+        A dry run is never checkpointed nor run in parallel, nor is an import run inside a transaction.
+        The errors of the rows imported by worker processes are logged but not collected.
+        """
         logger.debug("importing csv {0}".format(file_path))
-        data_frame = self.get_rows_as_data_frame(file_path,
-                                                 sheet_name=kwargs.pop("sheet_name", 0) or 0)
-        self.validate_columns(list(data_frame.columns))
-        data_dict = self.get_data_frame_as_dict(data_frame)
-        imported_number = error_number = 0
-        for row_number, row in enumerate(data_dict):
-            if self._import_row(row, row_number=row_number + 1, **kwargs):
-                imported_number += 1
+        import_file = self.get_import_file(file_path)
+        self._dry_run = kwargs.pop("dry_run", self.dry_run)
+        self.continue_on_error = kwargs.pop("continue_on_error", self.continue_on_error)
+        collect_errors = kwargs.pop("collect_errors", self.collect_errors)
+        errors_file = kwargs.pop("errors_file", self.errors_file)
+        rejects_file = kwargs.pop("rejects_file", self.rejects_file)
+        batch_size = kwargs.pop("batch_size", self.batch_size)
+        chunk_size = kwargs.pop("chunk_size", self.chunk_size)
+        sheet_name = kwargs.pop("sheet_name", 0) or 0
+        workers = kwargs.pop("workers", self.workers)
+        from_row = kwargs.pop("from_row", self.from_row) or 1
+        checkpoint = kwargs.pop("checkpoint", self.checkpoint)
+        checkpoint = None if self._dry_run else self.get_checkpoint(import_file, checkpoint)
+        if checkpoint is not None and connections[self.get_db_alias() or DEFAULT_DB_ALIAS].in_atomic_block:
+            # The batches are only committed with the transaction of the caller
+            self.logger.warning("Not checkpointing the import of {0}, it runs inside a transaction".format(file_path))
+            checkpoint = None
+        state = checkpoint.load() if checkpoint is not None else None
+        if state:
+            from_row = state['next_row']
+            self.logger.info("Resuming the import of {0} from row {1}".format(file_path, from_row))
+        self._metrics = self.get_metrics(
+            collect=kwargs.pop("metrics", self.collect_metrics),
+            sink=kwargs.pop("metrics_sink", self.metrics_sink),
+            profile=kwargs.pop("profile", None),
+        )
+        row_tracer = RowTracer(self.logger, sample_every=kwargs.pop("trace_rows_every", self.trace_rows_every),
+                               max_per_second=kwargs.pop("trace_rows_per_second", self.trace_rows_per_second))
+        self._row_tracer = row_tracer if row_tracer.enabled else None
+        signals.import_started.send(sender=self.__class__, importer=self, file_path=file_path)
+        with ExitStack() as stack:
+            self._errors = self.get_error_collector(errors_file) if (
+                self._dry_run or collect_errors or errors_file) else None
+            if self._errors is not None:
+                stack.callback(self._errors.close)
+            self._rejects = self.get_rejects_writer(rejects_file, append=bool(state)) if rejects_file else None
+            if self._rejects is not None:
+                stack.callback(self._rejects.close)
+            if self._metrics is not None:
+                stack.enter_context(connections[self.get_db_alias() or DEFAULT_DB_ALIAS].execute_wrapper(
+                    self._metrics))
+                self._metrics.start()
+            batches = self.iter_batches(import_file, sheet_name=sheet_name,
+                                        batch_size=batch_size, chunk_size=chunk_size, from_row=from_row)
+            # Counters of the rows imported before from_row
+            row_count, imported_number, error_number = from_row - 1, 0, 0
+            if state:
+                row_count, imported_number, error_number = state['rows'], state['imported'], state['errors']
+            if workers and workers > 1 and not self._dry_run:
+                # Chunks are committed out of order, the parallel import is not checkpointed
+                from .parallel import import_batches_in_parallel
+                rows, imported, errors = import_batches_in_parallel(
+                    self, batches, workers=workers, batch_size=batch_size, from_row=from_row, **kwargs)
+                row_count += rows
+                imported_number += imported
+                error_number += errors
+                yield self.get_progress_event(row_count, imported_number, error_number)
             else:
-                error_number += 1
-        self.logger.info(_("Imported CSV of {0} rows of which {1} were not processed"
-                           "".format(len(data_dict), error_number)))
-        return {'rows': len(data_dict), 'imported': imported_number, 'errors': error_number}
+                self.start_batch(batch_size)
+                checkpointed = checkpoint is not None and self.transaction_mode != "file"
+                with self.get_transaction("file"):
+                    for rows in batches:
+                        # A checkpointed batch is committed as a whole, a crash never leaves part of it written
+                        with transaction.atomic(using=self.get_db_alias()) if checkpointed else ExitStack():
+                            imported, errors = self.import_rows(
+                                list(enumerate(rows, start=row_count + 1)), **kwargs)
+                        row_count += len(rows)
+                        imported_number += imported
+                        error_number += errors
+                        self.report_progress(row_count, imported_number, error_number)
+                        if checkpointed:
+                            checkpoint.save(row_count + 1, row_count, imported_number, error_number)
+                        yield self.get_progress_event(row_count, imported_number, error_number)
+        if checkpoint is not None:
+            checkpoint.clear()
+        self.logger.info(_("{0} CSV of {1} rows of which {2} were not processed"
+                           "".format("Validated" if self._dry_run else "Imported", row_count, error_number)))
+        result = {'rows': row_count, 'imported': imported_number, 'errors': error_number}
+        if self._errors is not None:
+            result['row_errors'] = self._errors
+        metrics = None
+        if self._metrics is not None:
+            self._metrics.finish(result)
+            metrics = result['metrics'] = self._metrics.as_dict(result)
+        signals.import_finished.send(sender=self.__class__, importer=self, result=result, metrics=metrics)
+        yield {'event': 'finished', 'result': result}
+
+    def get_error_collector(self, errors_file=None):
+        return ErrorCollector(max_in_memory=self.max_errors_in_memory, file_path=errors_file)
+
+    def get_rejects_writer(self, rejects_file, append=False):
+        """ Rejects of a resumed import are appended to the ones of the previous run"""
+        return RejectsWriter(rejects_file, delimiter=self.delimiter, quotechar=self.quotechar, append=append,
+                             format_value=self.format_rejected_value)
+
+    def format_rejected_value(self, column_name, value):
+        """ Text of a cell of a rejected row, invalid cells keep their raw value"""
+        if isinstance(value, InvalidValue):
+            return value.raw_value
+        return "" if value is None else value
+
+    def get_worker_init_kwargs(self):
+        """ kwargs building the importer of the worker processes, with the options of the current run"""
+        return dict(self.init_kwargs, continue_on_error=self.continue_on_error)
+
+    def get_progress_event(self, rows, imported, errors):
+        return {'event': 'progress', 'rows': rows, 'imported': imported, 'errors': errors}
+
+    def get_checkpoint(self, file_path, checkpoint=None):
+        """
+        Return the FileCheckpoint of file_path, None when checkpoint is not set.
+        Each batch (or chunk) is then imported in a transaction and checkpointed once committed,
+        so with transaction_mode "file" nothing is saved.
+        """
+        if not checkpoint:
+            return None
+        import_file = self.get_import_file(file_path)
+        if import_file.path is not None:
+            return FileCheckpoint(import_file.path, checkpoint_path=None if checkpoint is True else checkpoint)
+        if checkpoint is True:
+            raise ImproperlyConfigured("The checkpoint of {0!r} needs a path".format(import_file))
+        return FileCheckpoint(import_file.name, checkpoint_path=checkpoint,
+                              file_signature={'name': import_file.name, 'size': import_file.get_size()})
+
+    def get_metrics(self, collect=False, sink=None, profile=None):
+        """
+        Return the ImportMetrics of the run, None when neither metrics, a sink
+        nor profiling are requested so the import is not instrumented at all
+        """
+        if not (collect or sink or profile):
+            return None
+        return ImportMetrics(self, sink=sink, profile=profile)
+
+    def measure(self, phase):
+        """ Context manager timing phase when metrics are collected"""
+        if self._metrics is None:
+            return ExitStack()
+        return self._metrics.phase(phase)
+
+    def import_rows(self, numbered_rows, **kwargs):
+        """ Import a batch of (row_number, row) pairs, returns the imported and errors counters"""
+        imported_number = error_number = 0
+        with self.get_transaction("batch"):
+            with self.measure("resolve"):
+                self.prepare_batch([row for row_number, row in numbered_rows])
+            with self.measure("rows"):
+                for row_number, row in numbered_rows:
+                    if self._import_row_in_transaction(row, row_number=row_number, **kwargs):
+                        imported_number += 1
+                    else:
+                        error_number += 1
+            with self.measure("write"):
+                failed_number = self.flush_batch() or 0
+        imported_number, error_number = imported_number - failed_number, error_number + failed_number
+        if numbered_rows:
+            self.logger.info(
+                "Imported rows %s-%s: %s imported, %s errors",
+                numbered_rows[0][0], numbered_rows[-1][0], imported_number, error_number,
+                extra={'import_batch': {'first_row': numbered_rows[0][0], 'last_row': numbered_rows[-1][0],
+                                        'imported': imported_number, 'errors': error_number}})
+        return imported_number, error_number
+
+    def get_db_alias(self):
+        """ Database used by the import transactions"""
+        return None
+
+    def get_transaction(self, scope):
+        """
+        Return the atomic block opened for scope ("file", "batch" or "row"):
+        a transaction when it is the configured transaction_mode, a savepoint for
+        the rows inside a "file" or "batch" transaction, otherwise a no-op context.
+        A dry run writes nothing and opens no transaction. With continue_on_error the rows
+        get a savepoint when the import runs inside a transaction opened by the caller.
+        """
+        if self._dry_run:
+            return ExitStack()
+        if self.transaction_mode == scope or (scope == "row" and self.transaction_mode in ("file", "batch")):
+            return transaction.atomic(using=self.get_db_alias())
+        if scope == "row" and self.continue_on_error and transaction.get_connection(
+                self.get_db_alias()).in_atomic_block:
+            return transaction.atomic(using=self.get_db_alias())
+        return ExitStack()
+
+    def _import_row_in_transaction(self, row, row_number, **kwargs):
+        if not (self.transaction_mode or self.continue_on_error):
+            return self._import_row(row, row_number=row_number, **kwargs)
+        try:
+            with self.get_transaction("row"):
+                return self._import_row(row, row_number=row_number, **kwargs)
+        except Exception as ex:
+            self.report_exception(row_number, row, ex)
+            self.rollback_row(row)
+            return False
+
+    def rollback_row(self, row=None):
+        """ Called with the failed row once its changes have been rolled back"""
+        pass
+
+    def get_partition_key(self, row):
+        """ Rows with the same key are imported by the same worker, None spreads them round robin"""
+        return None
+
+    def prepare_shared_objects(self, rows):
+        """
+        Called by the parallel import with the rows of each batch before partitioning them,
+        to write the objects shared by rows of different partitions
+        """
+        pass
+
+    def report_row_error(self, row_number, column_name, raw_value, error, row=None):
+        """
+        Log an error of a row, column_name is None when it is not about a single cell.
+        The error is collected and row written to the rejects file when they are enabled.
+        """
+        if column_name is None:
+            self.logger.warning("Row number {0}: {1}".format(row_number, error))
+        else:
+            self.logger.warning("Row number {0} has an invalid value {1!r} in column {2}: {3}".format(
+                row_number, raw_value, column_name, error))
+        if self._errors is not None:
+            self._errors.add(row_number, column_name, raw_value, error)
+        if self._rejects is not None and row is not None:
+            self._rejects.write(row_number, row)
+
+    def report_validation_error(self, row_number, row, error):
+        """ Report the messages of a ValidationError, on the column of their field when it is known"""
+        if not hasattr(error, 'error_dict'):
+            for message in error.messages:
+                self.report_row_error(row_number, None, None, ValidationError(message), row=row)
+            return
+        for field_path, field_errors in error.error_dict.items():
+            column_name = self.get_error_column(field_path, row)
+            for message in ValidationError(field_errors).messages:
+                self.report_row_error(row_number, column_name, row.get(column_name), ValidationError(message),
+                                      row=row)
+
+    def report_exception(self, row_number, row, error):
+        if isinstance(error, ValidationError):
+            self.report_validation_error(row_number, row, error)
+        else:
+            self.report_row_error(row_number, None, None, error, row=row)
+
+    def get_error_column(self, field_path, row):
+        """ Column of row holding the value of field_path, None when there is none"""
+        return field_path if field_path in row else None
 
     def _import_row(self, row, row_number, **kwargs):
+        invalid_values = [value for value in row.values() if isinstance(value, InvalidValue)]
+        if invalid_values:
+            for invalid_value in invalid_values:
+                self.report_row_error(row_number, invalid_value.column_name, invalid_value.raw_value,
+                                      invalid_value.error, row=row)
+            return False
         callback = kwargs.get('callback', None)
         kwargs = kwargs or {}
-        kwargs.update({'items': row})
-        if callback and hasattr(self, callback):
-            return getattr(self, callback)(**kwargs)
-        else:
-            return self.process_row(**kwargs)
+        kwargs.update({'items': row, 'row_number': row_number})
+        self._current_row = (row_number, row)
+        try:
+            if callback and hasattr(self, callback):
+                result = getattr(self, callback)(**kwargs)
+            else:
+                result = self.process_row(**kwargs)
+        except (ValidationError, ValueError) as ex:
+            if not self._dry_run:
+                raise
+            self.report_exception(row_number, row, ex)
+            self.rollback_row(row)
+            result = False
+        finally:
+            self._current_row = None
+        if self._row_tracer is not None:
+            self._row_tracer.trace(row_number, "imported" if result else "not imported", values=row)
+        return result
+
+    def start_batch(self, batch_size=None):
+        """ Called once before the first row, batch_size is None when batching is disabled"""
+        pass
+
+    def prepare_batch(self, rows):
+        """ Called with the rows of each batch (the whole file without batch_size) before importing them"""
+        pass
+
+    def flush_batch(self):
+        """
+        Called every batch_size rows and after the last row to write the pending rows,
+        returns the number of rows that could not be written
+        """
+        return 0
 
     def process_row(self, **kwargs):
         raise NotImplementedError()
@@ -148,6 +735,20 @@ class ModelCSVImporter(BaseModelCSVImporter):
 
     can_add_fk = True
     can_add_m2m = True
+    # Create the child objects of reverse foreign key columns, e.g. "questions__text"
+    can_add_children = True
+    # Fields identifying the children of each reverse relation, e.g. {"questions": ["text"]}: children
+    # matching an existing child of their parent are not created again. By default the fields set
+    # by the columns of the relation, an empty list always creates them.
+    child_match_fields = {}
+    # Other names of the countries of CountryField columns, mapped on a country name or code
+    country_aliases = {
+        "China (PR)": "China",
+        "USA": "United States of America",
+        "Viet Nam": "Vietnam",
+        "Korea (Republic)": "North Korea",
+        "Korea (the Republic of)": "North Korea",
+    }
 
     m2m_separator = '|'
 
@@ -156,13 +757,659 @@ class ModelCSVImporter(BaseModelCSVImporter):
         # ...
     }
 
-    def get_model_field_name(self, csv_string):
+    # Load the objects matching the import ids of each batch with set-based queries
+    prefetch_import_ids = True
+    # Convert date, time, datetime and numeric columns a whole chunk at a time
+    convert_columns = True
+    # strptime formats of the converted columns, None infers them from the data
+    date_format = None
+    datetime_format = None
+    time_format = None
+    # Format of specific columns, e.g. {"Birth date": "%d/%m/%Y"}
+    column_formats = {}
+    # Max number of related objects cached for each foreign key / m2m column (LRU eviction)
+    fk_cache_size = 10000
+    m2m_cache_size = 10000
+    # Writer of the batched objects without m2m relations, e.g. writers.CopyWriter for PostgreSQL COPY
+    writer_class = None
+    # Only read the columns of db_mapping, the other ones are never parsed
+    read_mapped_columns_only = False
+    # Compare the values of the updated objects and only write the changed fields
+    skip_unchanged = False
+    # Model field storing a hash of the mapped values, with skip_unchanged the rows
+    # whose hash did not change are skipped without loading their object
+    content_hash_field = None
+    _unchanged_import_ids = frozenset()
+    _content_hashes = {}
+    # Rows of a batch repeating an import id are merged in the object of the first one, written
+    # once per batch with batch_size: their m2m tokens are united, each row adds its children and
+    # the "first" or "last" value of the other fields wins
+    merge_policy = "last"
+    merge_policies = ("first", "last")
+    _batch_objects = None
+
+    _pending_objects = None
+    _import_id_index = None
+
+    def __init__(self, **kwargs):
+        super(ModelCSVImporter, self).__init__(**kwargs)
+        self.writer_class = kwargs.get('writer_class', self.writer_class)
+        self.read_mapped_columns_only = kwargs.get('read_mapped_columns_only', self.read_mapped_columns_only)
+        self.skip_unchanged = kwargs.get('skip_unchanged', self.skip_unchanged)
+        self.content_hash_field = kwargs.get('content_hash_field', self.content_hash_field)
+        self.merge_policy = kwargs.get('merge_policy', self.merge_policy)
+
+    def get_worker_init_kwargs(self):
+        """ The options of the model import are forwarded even when set after __init__"""
+        worker_init_kwargs = super(ModelCSVImporter, self).get_worker_init_kwargs()
+        for option in ['writer_class', 'read_mapped_columns_only', 'skip_unchanged', 'content_hash_field',
+                       'merge_policy']:
+            worker_init_kwargs[option] = getattr(self, option)
+        return worker_init_kwargs
+
+    def start_batch(self, batch_size=None):
+        if self.merge_policy not in self.merge_policies:
+            raise ImproperlyConfigured("Invalid merge_policy {0!r}, choose one of {1}".format(
+                self.merge_policy, self.merge_policies))
+        self._import_id_index = None
+        self._unchanged_import_ids = frozenset()
+        self._batch_objects = {}
+        self._related_resolvers = {}
+        self._field_plans = {}
+        if batch_size:
+            self._pending_objects = {}
+            self._pending_update_fields = set()
+        else:
+            self._pending_objects = None
+
+    def get_usecols(self, engine=None, header=None):
+        if not self.read_mapped_columns_only:
+            return None
+        column_names = list(self.db_mapping)
+        if engine == "pyarrow":
+            return column_names if header is None else [
+                column_name for column_name in column_names if column_name in header]
+        column_names = set(column_names)
+        # A callable does not fail when a mapped column is missing from the file
+        return lambda column_name: column_name in column_names
+
+    def get_column_dtypes(self):
+        """ Foreign key columns repeat few values, they are read as categories"""
+        column_dtypes = {}
+        for _column_name in self.db_mapping:
+            column_plan = self.get_column_plan(_column_name)
+            if column_plan is not None and column_plan.kind == 'fk':
+                column_dtypes[_column_name] = "category"
+        column_dtypes.update(self.column_dtypes)
+        return column_dtypes
+
+    def get_import_id_index(self):
+        if self._import_id_index is None:
+            self._import_id_index = ImportIdIndex(self.model, self.get_import_id_field_name(),
+                                                  queryset=self.model.objects.all())
+        return self._import_id_index
+
+    def get_related_resolver(self, related_model, related_field_name, max_size=None):
+        resolvers = getattr(self, '_related_resolvers', None)
+        if resolvers is None:
+            resolvers = self._related_resolvers = {}
+        key = (related_model, related_field_name)
+        if key not in resolvers:
+            resolvers[key] = RelatedObjectResolver(related_model, related_field_name,
+                                                   queryset=related_model.objects.all(),
+                                                   max_size=max_size)
+        return resolvers[key]
+
+    def get_field_plan(self, columns):
+        """
+        Compile once per header the list of ColumnPlan used by process_row.
+        Columns not mapped on a model field are dropped.
+        """
+        columns = tuple(columns)
+        field_plans = getattr(self, '_field_plans', None)
+        if field_plans is None:
+            field_plans = self._field_plans = {}
+        if columns not in field_plans:
+            field_plans[columns] = [
+                column_plan for column_plan in (self.get_column_plan(_column_name) for _column_name in columns)
+                if column_plan is not None
+            ]
+        return field_plans[columns]
+
+    def get_column_plan(self, _column_name):
+        _field_name = self.get_model_field_name(_column_name)
+        try:
+            model_field = self.model._meta.get_field(_field_name)
+        except FieldDoesNotExist:
+            return None
+        # DateTimeField is a DateField subclass so it has to be checked first
+        if isinstance(model_field, fields.DateTimeField):
+            return ColumnPlan(_column_name, _field_name, model_field, 'value', self.process_datetime_field)
+        elif isinstance(model_field, fields.DateField):
+            return ColumnPlan(_column_name, _field_name, model_field, 'value', self.process_date_field)
+        elif isinstance(model_field, fields.TimeField):
+            return ColumnPlan(_column_name, _field_name, model_field, 'value', self.process_time_field)
+        elif isinstance(model_field, fields.related.ForeignKey):
+            return ColumnPlan(_column_name, _field_name, model_field, 'fk', self.process_fk_field)
+        elif isinstance(model_field, fields.related.ManyToManyField):
+            return ColumnPlan(_column_name, _field_name, model_field, 'm2m', self.process_m2m_field)
+        elif CountryField and "django_countries" in settings.INSTALLED_APPS and isinstance(model_field, CountryField):
+            return ColumnPlan(_column_name, _field_name, model_field, 'value', self.process_django_countries_field)
+        elif model_field.one_to_many:
+            # Reverse foreign keys (e.g. "questions__text") create a child object per row
+            return ColumnPlan(_column_name, _field_name, model_field, 'children', self.process_reverse_fk_field)
+        elif not model_field.concrete:
+            return None
+        return ColumnPlan(_column_name, _field_name, model_field, 'value', self.set_model_attr)
+
+    def get_column_converter(self, column_plan):
+        """ Return the function converting the Series of column_plan, or None"""
+        model_field = column_plan.model_field
+        column_format = self.column_formats.get(column_plan.column_name)
+        if isinstance(model_field, fields.DateTimeField):
+            return lambda series: convert_datetime_series(
+                series, kind="datetime", date_format=column_format or self.datetime_format)
+        elif isinstance(model_field, fields.DateField):
+            return lambda series: convert_datetime_series(
+                series, kind="date", date_format=column_format or self.date_format)
+        elif isinstance(model_field, fields.TimeField):
+            return lambda series: convert_datetime_series(
+                series, kind="time", date_format=column_format or self.time_format)
+        elif isinstance(model_field, (fields.IntegerField, fields.AutoField)):
+            return lambda series: convert_numeric_series(series, kind="int")
+        elif isinstance(model_field, fields.DecimalField):
+            return lambda series: convert_numeric_series(series, kind="decimal")
+        elif isinstance(model_field, fields.FloatField):
+            return lambda series: convert_numeric_series(series, kind="float")
+        return None
+
+    def convert_data_frame(self, data_frame):
+        if not self.convert_columns:
+            return data_frame
+        converted_columns = {}
+        for column_plan in self.get_field_plan(data_frame.columns):
+            if column_plan.kind != 'value':
+                continue
+            converter = self.get_column_converter(column_plan)
+            if converter is not None:
+                converted_columns[column_plan.column_name] = converter(data_frame[column_plan.column_name])
+        if converted_columns:
+            data_frame = data_frame.assign(**converted_columns)
+        return data_frame
+
+    def get_relation_columns(self, columns, kind):
+        """ Return the (column, field) pairs of the columns of the given plan kind ("fk" or "m2m")"""
+        return [(column_plan.column_name, column_plan.model_field)
+                for column_plan in self.get_field_plan(columns) if column_plan.kind == kind]
+
+    def get_fk_columns(self, columns):
+        return self.get_relation_columns(columns, 'fk')
+
+    def get_m2m_columns(self, columns):
+        return self.get_relation_columns(columns, 'm2m')
+
+    def split_m2m_value(self, value):
+        return [_value.strip() for _value in value.split(self.m2m_separator) if _value.strip()]
+
+    def prefetch_fk_objects(self, rows):
+        """ Resolve the distinct values of each foreign key column with one query per column"""
+        if not rows:
+            return
+        for _column_name, model_field in self.get_fk_columns(rows[0].keys()):
+            fk_model = model_field.related_model
+            resolver = self.get_related_resolver(fk_model, self.get_model_related_field_name(_column_name),
+                                                 max_size=self.fk_cache_size)
+            resolver.prefetch((row[_column_name] for row in rows if row[_column_name] != 'NULL'),
+                              create_missing=self.can_add_fk_object(fk_model) and not self._dry_run)
+
+    def prefetch_m2m_objects(self, rows):
+        """
+        Resolve the distinct tokens of each m2m column with one query per column
+        and create the missing ones allowed by can_add_m2m_object with a bulk insert
+        """
+        if not rows:
+            return
+        for _column_name, model_field in self.get_m2m_columns(rows[0].keys()):
+            m2m_model = model_field.related_model
+            resolver = self.get_related_resolver(m2m_model, self.get_model_related_field_name(_column_name),
+                                                 max_size=self.m2m_cache_size)
+            missing_values = resolver.prefetch(
+                _value for row in rows if row[_column_name] and row[_column_name] != 'NULL'
+                for _value in self.split_m2m_value(row[_column_name])
+            )
+            missing_values = [_value for _value in missing_values
+                              if self.can_add_m2m_object(m2m_model, value=_value)]
+            if missing_values and not self._dry_run:
+                resolver.bulk_create(missing_values)
+
+    def prepare_batch(self, rows):
+        for resolver in self._related_resolvers.values():
+            resolver.created_keys = []
+        self._batch_objects = {}
+        self._content_hashes = {}
+        self.prefetch_fk_objects(rows)
+        self.prefetch_m2m_objects(rows)
+        if not self.get_import_id_field_name():
+            return
+        if self.content_hash_field:
+            self._content_hashes = self.get_content_hashes(rows)
+        self._unchanged_import_ids = self.get_unchanged_import_ids(self._content_hashes)
+        index = self.get_import_id_index()
+        index.clear()
+        if self.prefetch_import_ids or self._dry_run:
+            index.prefetch(import_id for import_id in (self.get_import_id(row) for row in rows)
+                           if import_id not in self._unchanged_import_ids)
+
+    def get_content_hash(self, row):
+        """ Hash of the mapped values of row"""
+        values = [[column_plan.column_name, str(row[column_plan.column_name])]
+                  for column_plan in self.get_field_plan(row)]
+        return hashlib.sha1(json.dumps(values).encode("utf-8")).hexdigest()
+
+    def get_content_hashes(self, rows):
+        """
+        Content hash of the rows of the batch sharing each import id, hashed together
+        in their order, so a change in any of them changes the hash of the object
+        """
+        row_hashes = {}
+        for row in rows:
+            import_id = self.get_import_id(row)
+            if import_id:
+                row_hashes.setdefault(import_id, []).append(self.get_content_hash(row))
+        return {
+            import_id: hashes[0] if len(hashes) == 1 else hashlib.sha1("".join(hashes).encode("utf-8")).hexdigest()
+            for import_id, hashes in row_hashes.items()
+        }
+
+    def get_unchanged_import_ids(self, content_hashes):
+        """ Import ids whose content hash is the one stored on their object"""
+        if not (self.skip_unchanged and self.content_hash_field):
+            return frozenset()
+        import_id_field_name = self.get_import_id_field_name()
+        import_id_field = self.model._meta.get_field(import_id_field_name)
+        # Keyed by the database value of the import id
+        row_hashes = {import_id_field.to_python(import_id): (import_id, content_hash)
+                      for import_id, content_hash in content_hashes.items()}
+        stored_hashes = filter_in_chunks(
+            self.model.objects.values_list(import_id_field_name, self.content_hash_field),
+            import_id_field_name, list(row_hashes))
+        return frozenset(row_hashes[key][0] for key, content_hash in stored_hashes
+                         if key in row_hashes and row_hashes[key][1] == content_hash)
+
+    def get_partition_key(self, row):
+        if self.get_import_id_field_name():
+            return self.get_import_id(row)
+        return None
+
+    def prepare_shared_objects(self, rows):
+        """
+        Create the missing foreign key and m2m objects of rows once, the workers importing
+        different partitions would otherwise both create the ones they have in common
+        """
+        self.prefetch_fk_objects(rows)
+        self.prefetch_m2m_objects(rows)
+
+    def get_object_by_import_id(self, import_id_field_name, import_id):
+        if self._import_id_index is not None and self._import_id_index.field_name == import_id_field_name:
+            return self._import_id_index.get(import_id)
+        return self.model.objects.get(**{import_id_field_name: import_id})
+
+    def is_batching(self):
+        return self._pending_objects is not None
+
+    def can_bulk_create_with_pk(self):
+        """ bulk_create sets the primary keys only on some backends (e.g. PostgreSQL)"""
+        if self.model._meta.parents:
+            return False
+        features = connections[router.db_for_write(self.model)].features
+        return getattr(features, 'can_return_rows_from_bulk_insert',
+                       getattr(features, 'can_return_ids_from_bulk_insert', False))
+
+    def save_object(self, obj, m2m_map, import_id=None, is_creation=True, update_fields=None, children=None):
+        """
+        Save obj, its m2m relations and its children, when batching the object is queued
+        and written by flush_batch(). An empty update_fields only writes the relations.
+        A dry run only validates them.
+        """
+        if self._dry_run:
+            if is_creation and import_id and self._import_id_index is not None:
+                self._import_id_index.add(import_id, obj)
+            self.validate_object(obj, children=children)
+            return
+        if not self.is_batching():
+            if update_fields is None or update_fields:
+                obj.save(update_fields=update_fields)
+            if m2m_map:
+                self.add_m2m_objects(obj, m2m_map)
+            if children:
+                self.bulk_create_children([(obj, children)])
+            if is_creation and import_id and self._import_id_index is not None:
+                self._import_id_index.add(import_id, obj)
+            return
+        if is_creation and import_id and self._import_id_index is not None:
+            self._import_id_index.add(import_id, obj)
+        pending = self._pending_objects.get(id(obj))
+        if pending is None:
+            pending = self._pending_objects[id(obj)] = {
+                'obj': obj,
+                'is_creation': is_creation or obj.pk is None,
+                'm2m_map': {},
+                'children': {},
+                'update_fields': None if update_fields is None else set(),
+                # (row_number, row) pairs that changed the object, reported when it cannot be written
+                'rows': [],
+            }
+        if self._current_row is not None:
+            pending['rows'].append(self._current_row)
+        if update_fields is None:
+            pending['update_fields'] = None
+        elif pending['update_fields'] is not None:
+            pending['update_fields'].update(update_fields)
+        for _field_name, m2m_objs in m2m_map.items():
+            # Merged rows often repeat the same tokens
+            pending_m2m_objs = pending['m2m_map'].setdefault(_field_name, [])
+            pending_m2m_objs.extend(m2m_obj for m2m_obj in m2m_objs if m2m_obj not in pending_m2m_objs)
+        for _field_name, child_objs in (children or {}).items():
+            pending['children'].setdefault(_field_name, []).extend(child_objs)
+
+    def format_rejected_value(self, column_name, value):
+        """ Converted dates and times are written back in the format they are read with"""
+        if isinstance(value, datetime.datetime):
+            column_format = self.column_formats.get(column_name) or self.datetime_format
+        elif isinstance(value, datetime.date):
+            column_format = self.column_formats.get(column_name) or self.date_format
+        elif isinstance(value, datetime.time):
+            column_format = self.column_formats.get(column_name) or self.time_format
+        else:
+            return super(ModelCSVImporter, self).format_rejected_value(column_name, value)
+        return value.strftime(column_format) if column_format else str(value)
+
+    def get_resolved_relation_names(self, obj):
+        """ Foreign keys of obj set to an object, they were resolved through the prefetched indexes"""
+        return [field.name for field in obj._meta.concrete_fields
+                if field.is_relation and (field.is_cached(obj) or getattr(obj, field.attname) is not None)]
+
+    def validate_object(self, obj, children=None):
+        """
+        Run clean_fields() on obj and its children, raises a ValidationError keyed by field path
+        (e.g. "questions__text"). Resolved foreign keys and unique constraints are not checked
+        so no query is made.
+        """
+        errors = {}
+        try:
+            obj.clean_fields(exclude=self.get_resolved_relation_names(obj))
+        except ValidationError as ex:
+            errors.update(ex.error_dict)
+        for _field_name, child_objs in (children or {}).items():
+            relation = obj._meta.get_field(_field_name)
+            for child_obj in child_objs:
+                try:
+                    child_obj.clean_fields(exclude=[relation.field.name] + self.get_resolved_relation_names(child_obj))
+                except ValidationError as ex:
+                    for child_field_name, field_errors in ex.error_dict.items():
+                        errors.setdefault(LOOKUP_SEP.join([_field_name, child_field_name]), []).extend(field_errors)
+        if errors:
+            raise ValidationError(errors)
+
+    def get_error_column(self, field_path, row):
+        for column_plan in self.get_field_plan(row):
+            if field_path in (column_plan.field_name,
+                              LOOKUP_SEP.join(self.split_model_field_path(column_plan.column_name))):
+                return column_plan.column_name
+        return None
+
+    def needs_pk(self, pending):
+        """ Objects with m2m relations or children need a primary key before they are linked"""
+        return bool(pending['m2m_map'] or pending['children'])
+
+    def get_db_alias(self):
+        return router.db_for_write(self.model)
+
+    def rollback_row(self, row=None):
+        # Objects created by the rolled back row no longer exist
+        for resolver in getattr(self, '_related_resolvers', {}).values():
+            resolver.forget_created()
+        import_id = self.get_import_id(row) if row is not None and self.get_import_id_field_name() else None
+        if not import_id:
+            return
+        pending = self.forget_import_id(import_id)
+        if pending is not None:
+            # The failed row may have changed the pending object, it is rebuilt from the rows merged before it
+            for row_number, merged_row in pending['rows']:
+                self._current_row = (row_number, merged_row)
+                self.process_row(items=merged_row, row_number=row_number)
+            self._current_row = None
+
+    def forget_import_id(self, import_id):
+        """
+        Drop the in-memory object of import_id, the next row with it loads it again.
+        Returns its pending entry, removed from the batch, when it was not written yet.
+        """
+        batch_object = self._batch_objects.pop(import_id, None) if self._batch_objects else None
+        if self._import_id_index is not None:
+            self._import_id_index.discard(import_id)
+        if batch_object is None or not self._pending_objects:
+            return None
+        return self._pending_objects.pop(id(batch_object['obj']), None)
+
+    def flush_batch(self):
+        if not self._pending_objects:
+            return 0
+        pending_objects = list(self._pending_objects.values())
+        self._pending_objects = {}
+        # A batch written one object at a time after a failure must not be partially written
+        write_transaction = transaction.atomic(using=self.get_db_alias()) if self.continue_on_error else (
+            self.get_transaction("row"))
+        try:
+            with write_transaction:
+                self.write_pending_objects(pending_objects)
+        except DatabaseError as ex:
+            if not (self.transaction_mode or self.continue_on_error):
+                raise
+            self.logger.warning("Bulk write failed ({0!r}), writing the batch one object at a time".format(ex))
+            failed_number = self.write_pending_objects_one_by_one(pending_objects)
+        else:
+            failed_number = 0
+        self._pending_update_fields = set()
+        return failed_number
+
+    def write_pending_objects_one_by_one(self, pending_objects):
+        """
+        Save each pending object in its own savepoint, returns the number of rows that failed.
+        The rows merged in an object that cannot be saved are imported again one at a time.
+        """
+        failed_number = 0
+        for pending in pending_objects:
+            if len(pending['rows']) > 1:
+                try:
+                    with self.get_transaction("row"):
+                        self.save_pending_object(pending)
+                except Exception as ex:
+                    self.logger.warning("Could not save {0!r} ({1!r}), importing its {2} rows one at a time".format(
+                        pending['obj'], ex, len(pending['rows'])))
+                    failed_number += self.import_pending_rows_one_by_one(pending)
+                continue
+            try:
+                with self.get_transaction("row"):
+                    self.save_pending_object(pending)
+            except Exception as ex:
+                if not pending['rows']:
+                    self.logger.error("Could not save {0!r}: {1!r}".format(pending['obj'], ex))
+                for row_number, row in pending['rows']:
+                    self.report_exception(row_number, row, ex)
+                failed_number += len(pending['rows']) or 1
+        return failed_number
+
+    def save_pending_object(self, pending):
+        if pending['is_creation'] or pending['update_fields'] is None:
+            pending['obj'].save()
+        elif pending['update_fields']:
+            pending['obj'].save(update_fields=pending['update_fields'])
+        if pending['m2m_map']:
+            self.add_m2m_objects(pending['obj'], pending['m2m_map'])
+        if pending['children']:
+            self.bulk_create_children([(pending['obj'], pending['children'])])
+
+    def import_pending_rows_one_by_one(self, pending):
+        """ Import the rows of pending without batching, each one saved in its own savepoint"""
+        for row_number, row in pending['rows']:
+            import_id = self.get_import_id(row) if self.get_import_id_field_name() else None
+            if import_id:
+                self.forget_import_id(import_id)
+        pending_objects, self._pending_objects = self._pending_objects, None
+        failed_number = 0
+        try:
+            for row_number, row in pending['rows']:
+                if not self._import_row_in_transaction(row, row_number=row_number):
+                    failed_number += 1
+        finally:
+            self._pending_objects = pending_objects
+        return failed_number
+
+    def get_writer(self):
+        if self.writer_class is None:
+            return None
+        return self.writer_class(self.model, using=self.get_db_alias() or DEFAULT_DB_ALIAS,
+                                 batch_size=self.batch_size)
+
+    def get_update_fields(self):
+        return sorted(_field_name for _field_name in self._pending_update_fields
+                      if not self.model._meta.get_field(_field_name).primary_key)
+
+    def get_update_groups(self, pending_objects):
+        """
+        Return the (objects, update_fields) pairs of the updated objects,
+        grouped by the fields to write when only the changed ones are written
+        """
+        groups = {}
+        for pending in pending_objects:
+            if pending['is_creation']:
+                continue
+            if pending['update_fields'] is None:
+                update_fields = tuple(self.get_update_fields())
+            else:
+                update_fields = tuple(sorted(pending['update_fields']))
+            if update_fields:
+                groups.setdefault(update_fields, []).append(pending['obj'])
+        return [(objs, list(update_fields)) for update_fields, objs in groups.items()]
+
+    def write_pending_objects(self, pending_objects):
+        writer = self.get_writer()
+        if writer is not None:
+            # Objects with m2m relations or children need a primary key, they are saved through the ORM below
+            written = [pending for pending in pending_objects if not self.needs_pk(pending)]
+            to_create = [pending['obj'] for pending in written if pending['is_creation']]
+            for to_update, update_fields in self.get_update_groups(written) or [([], self.get_update_fields())]:
+                writer.write(to_create, to_update, update_fields, conflict_field=self.get_import_id_field_name())
+                to_create = []
+            pending_objects = [pending for pending in pending_objects if self.needs_pk(pending)]
+        to_create = [pending['obj'] for pending in pending_objects if pending['is_creation']]
+        update_groups = self.get_update_groups(pending_objects)
+        if to_create:
+            if self.can_bulk_create_with_pk():
+                self.model.objects.bulk_create(to_create, batch_size=self.batch_size)
+            else:
+                with_relations = [pending['obj'] for pending in pending_objects
+                                  if pending['is_creation'] and self.needs_pk(pending)]
+                for obj in with_relations:
+                    obj.save()
+                if len(with_relations) < len(to_create):
+                    self.model.objects.bulk_create([obj for obj in to_create if obj.pk is None],
+                                                   batch_size=self.batch_size)
+        for to_update, update_fields in update_groups:
+            self.model.objects.bulk_update(to_update, update_fields, batch_size=self.batch_size)
+        self.bulk_add_m2m_objects(
+            [(pending['obj'], pending['m2m_map']) for pending in pending_objects if pending['m2m_map']])
+        self.bulk_create_children(
+            [(pending['obj'], pending['children']) for pending in pending_objects if pending['children']])
+        logger.debug("Flushed batch of {0} created and {1} updated objects".format(
+            len(to_create), sum(len(to_update) for to_update, update_fields in update_groups)))
+
+    def bulk_add_m2m_objects(self, m2m_links):
+        """
+        Write the m2m relations of many objects with one insert per through model.
+        m2m_changed signals are not sent.
+        """
+        through_objs = {}
+        for obj, m2m_map in m2m_links:
+            for _field_name, m2m_objs in m2m_map.items():
+                m2m_field = obj._meta.get_field(_field_name)
+                through = m2m_field.remote_field.through
+                for m2m_obj in m2m_objs:
+                    through_objs.setdefault(through, []).append(through(**{
+                        m2m_field.m2m_field_name(): obj,
+                        m2m_field.m2m_reverse_field_name(): m2m_obj,
+                    }))
+        for through, objs in through_objs.items():
+            through.objects.bulk_create(objs, batch_size=self.batch_size, ignore_conflicts=True)
+
+    def bulk_create_children(self, children_links):
+        """
+        Create the children of many saved parents with one insert per child model,
+        their foreign key is set from the primary key the parent got once saved.
+        Children already existing are not created again, see get_new_child_objects().
+        """
+        children_by_relation = {}
+        for obj, children in children_links:
+            for _field_name, child_objs in children.items():
+                relation = obj._meta.get_field(_field_name)
+                for child_obj in child_objs:
+                    setattr(child_obj, relation.field.name, obj)
+                children_by_relation.setdefault((_field_name, relation), []).extend(child_objs)
+        children_by_model = {}
+        for (_field_name, relation), child_objs in children_by_relation.items():
+            children_by_model.setdefault(relation.related_model, []).extend(
+                self.get_new_child_objects(_field_name, relation, child_objs))
+        for child_model, child_objs in children_by_model.items():
+            if child_objs:
+                child_model.objects.bulk_create(child_objs, batch_size=self.batch_size)
+
+    def get_child_match_fields(self, _field_name):
+        """ Fields of the children of the reverse relation _field_name compared with the existing ones"""
+        if _field_name in self.child_match_fields:
+            return list(self.child_match_fields[_field_name])
+        return [self.get_model_related_field_name(_column_name) for _column_name in self.db_mapping
+                if self.get_model_field_name(_column_name) == _field_name]
+
+    def get_new_child_objects(self, _field_name, relation, child_objs):
+        """
+        Drop the children matching, on get_child_match_fields(), an existing child of their parent
+        or another child of the batch. The existing children are read with one query per relation.
+        """
+        match_fields = [relation.related_model._meta.get_field(field_name)
+                        for field_name in self.get_child_match_fields(_field_name)]
+        if not match_fields:
+            return child_objs
+        parent_field = relation.field
+
+        def get_key(parent_id, values):
+            return (parent_id,) + tuple(field.to_python(value) for field, value in zip(match_fields, values))
+
+        existing_children = filter_in_chunks(
+            relation.related_model._default_manager.values_list(
+                parent_field.attname, *[field.attname for field in match_fields]),
+            parent_field.attname, {getattr(child_obj, parent_field.attname) for child_obj in child_objs})
+        keys = {get_key(values[0], values[1:]) for values in existing_children}
+        new_child_objs = []
+        for child_obj in child_objs:
+            key = get_key(getattr(child_obj, parent_field.attname),
+                          [getattr(child_obj, field.attname) for field in match_fields])
+            if key not in keys:
+                keys.add(key)
+                new_child_objs.append(child_obj)
+        return new_child_objs
+
+    def split_model_field_path(self, csv_string):
+        """ Split "user.username" or "user__username" in ["user", "username"]"""
         field = self.db_mapping.get(csv_string, csv_string) or csv_string
-        return field.split('.')[0]
+        separator = '.' if '.' in field else LOOKUP_SEP
+        return field.split(separator, 1)
+
+    def get_model_field_name(self, csv_string):
+        return self.split_model_field_path(csv_string)[0]
 
     def get_model_related_field_name(self, csv_string):
-        field = self.db_mapping.get(csv_string, csv_string) or csv_string
-        return field.split('.')[1] if len(field.split('.')) > 1 else field
+        return self.split_model_field_path(csv_string)[-1]
 
     def get_import_id(self, columns):
         return columns[self.get_import_id_column_index()]
@@ -179,47 +1426,60 @@ class ModelCSVImporter(BaseModelCSVImporter):
     def can_add_m2m_object(self, m2m_model, value=""):
         return self.can_add_m2m
 
+    def can_add_child_object(self, child_model, values=None):
+        return self.can_add_children
+
     def get_m2m_object(self, m2m_model, m2m_field_name, m2m_field_value):
-        return m2m_model.objects.get(**({m2m_field_name: m2m_field_value}))
+        resolver = self.get_related_resolver(m2m_model, m2m_field_name, max_size=self.m2m_cache_size)
+        return resolver.get(m2m_field_value)
 
     def create_m2m_object(self, m2m_model, m2m_field_name, m2m_field_value):
-        return m2m_model.objects.create(**({m2m_field_name: m2m_field_value}))
+        resolver = self.get_related_resolver(m2m_model, m2m_field_name, max_size=self.m2m_cache_size)
+        return self.resolve_related_object(resolver, m2m_field_value, create=True)
+
+    def resolve_related_object(self, resolver, value, create=False):
+        """ Resolve value with resolver, a dry run returns an unsaved object instead of creating it"""
+        if not self._dry_run:
+            return resolver.resolve(value, create=create)
+        try:
+            return resolver.get(value)
+        except ObjectDoesNotExist:
+            if not create:
+                raise
+        return resolver.model(**{resolver.field_name: resolver.get_key(value)})
 
     def set_model_attr(self, obj, _field_name, value):
         setattr(obj, _field_name, value)
 
     def process_date_field(self, obj, _field_name, value):
-        setattr(obj, _field_name, parse(value).date())
+        setattr(obj, _field_name, parse(value).date() if isinstance(value, str) else value)
 
     def process_time_field(self, obj, _field_name, value):
-        setattr(obj, _field_name, parse(value).time())
+        setattr(obj, _field_name, parse(value).time() if isinstance(value, str) else value)
 
     def process_datetime_field(self, obj, _field_name, value):
-        setattr(obj, _field_name, parse(value))
+        value = parse(value) if isinstance(value, str) else value
+        if settings.USE_TZ and timezone.is_naive(value):
+            # Same interpretation Django applies to naive values, without the RuntimeWarning
+            value = timezone.make_aware(value)
+        setattr(obj, _field_name, value)
 
     def process_fk_field(self, obj, _field_name, _column_name, value):
-        fk_model = getattr(obj.__class__, _field_name).field.remote_field.related_model
+        fk_model = obj._meta.get_field(_field_name).related_model
         fk_name = self.get_model_related_field_name(_column_name)
+        resolver = self.get_related_resolver(fk_model, fk_name, max_size=self.fk_cache_size)
         try:
-            setattr(obj, _field_name, fk_model.objects.get(**({fk_name: value})))
+            setattr(obj, _field_name, self.resolve_related_object(resolver, value,
+                                                                  create=self.can_add_fk_object(fk_model)))
         except ObjectDoesNotExist:
-            if self.can_add_fk_object(fk_model):
-                fk_obj = fk_model.objects.create(**({fk_name: int(value)}))
-                setattr(obj, _field_name, fk_obj)
+            pass
 
     def process_m2m_field(self, obj, _field_name, _column_name, value, _columns):
         m2m_map = {}
-        if getattr(obj.__class__, _field_name).field.related_model:
-            m2m_model = getattr(obj.__class__, _field_name).field.related_model
-        elif getattr(obj.__class__, _field_name).field.remote_field.related_model:
-            m2m_model = getattr(obj.__class__, _field_name).field.remote_field.related_model
+        m2m_model = obj._meta.get_field(_field_name).related_model
         m2m_name = self.get_model_related_field_name(_column_name)
-        print("m2m_model : {m2m_model}\nm2m_name : {m2m_name}\n".format(m2m_model=m2m_model,
-                                                                        m2m_name=m2m_name))
         m2m_objs = []
-        for _value in value.split(self.m2m_separator):
-            _value = _value.strip()
-            print("_value for model {model} : {value}".format(value=_value, model=m2m_model))
+        for _value in self.split_m2m_value(value):
             try:
                 m2m_obj = self.get_m2m_object(
                     m2m_model=m2m_model,
@@ -243,46 +1503,60 @@ class ModelCSVImporter(BaseModelCSVImporter):
             # getattr(obj,_field_name).add(m2m_obj)
         return m2m_map
 
+    def get_country_index(self):
+        return get_country_index(aliases=self.country_aliases)
+
     def process_django_countries_field(self, obj, _field_name, value):
-        _country_found = False
-        if value == "China (PR)":
-            value = "China"
-        elif value == "USA":
-            value = "United States of America"
-        elif value == "Viet Nam":
-            value = "Vietnam"
-        elif value in ["Korea (Republic)", "Korea (the Republic of)"]:
-            value = "North Korea"
-        for _country_choice in COUNTRY_CHOICES:
-            if _country_choice[1] == value:
-                setattr(obj, _field_name, _country_choice[0])
-                _country_found = True
-        if not _country_found:
+        country_index = self.get_country_index()
+        if value in country_index.unknown:
+            return
+        code = country_index.get(value)
+        if code is None:
+            # Reported once, unknown names are remembered by the index
             logger.warning(
                 "Not Found any Country with name {country_name} for entry {entry}".format(
                     country_name=value, entry=obj))
+            return
+        setattr(obj, _field_name, code)
+
+    def process_reverse_fk_field(self, obj, _field_name, _column_name, value, _columns):
+        """ Return the values of the child object set by _column_name, e.g. {"questions": {"text": value}}"""
+        return {_field_name: {self.get_model_related_field_name(_column_name): value}}
+
+    def get_child_objects(self, obj, children_values):
+        """ Build the unsaved child objects of a row, one per reverse relation"""
+        children = {}
+        for _field_name, values in children_values.items():
+            child_model = obj._meta.get_field(_field_name).related_model
+            if self.can_add_child_object(child_model, values):
+                children[_field_name] = [child_model(**values)]
+        return children
 
     def add_m2m_objects(self, obj, m2m_map):
         for _field_name, m2m_objs in m2m_map.items():
-            for m2m_obj in m2m_objs:
-                getattr(obj, _field_name).add(m2m_obj)
+            getattr(obj, _field_name).add(*m2m_objs)
 
     def process_row(self, **kwargs):
         m2m_map = {}
+        children_values = {}
         _columns = kwargs.get('items')
         import_id = self.get_import_id(_columns)
         import_id_field_name = self.get_import_id_field_name()
+        if import_id and import_id in self._unchanged_import_ids:
+            # Same content hash, the object is not even loaded
+            return True
         _is_creation = True
-        if import_id and import_id_field_name:
+        batch_object = self._batch_objects.get(import_id) if import_id and self._batch_objects is not None else None
+        if batch_object is not None:
+            # Repeats the import id of a row of the batch, merged in its object
+            obj, _is_creation = batch_object['obj'], batch_object['is_creation']
+        elif import_id and import_id_field_name:
             try:
-                obj = self.model.objects.get(**{import_id_field_name: import_id})
+                obj = self.get_object_by_import_id(import_id_field_name, import_id)
                 _is_creation = False
-                if self.can_update:
-                    logger.info("Updating Model with id %s" % (import_id,))
             except ObjectDoesNotExist:
                 obj = self.model()
                 if self.can_create:
-                    logger.info("Importing Model with id %s" % (import_id,))
                     # if isinstance(obj._meta.get_field(import_id_field_name), fields.related.ManyToManyField):
                     #     obj._meta.get_field(import_id_field_name).set(import_id)
                     # else:
@@ -291,38 +1565,54 @@ class ModelCSVImporter(BaseModelCSVImporter):
             obj = self.model()
 
         if (_is_creation and self.can_create) or (not _is_creation and self.can_update):
-            for key, value in _columns.items():
-                _column_name = key
+            # Fields actually changed on an existing object, None writes all of them
+            changed_fields = set() if self.skip_unchanged and not _is_creation else None
+            # Fields set by the rows merged in obj
+            merged_fields = batch_object['fields'] if batch_object is not None else set()
+            for column_plan in self.get_field_plan(_columns):
+                value = _columns[column_plan.column_name]
                 if value is not None and value != 'NULL' and value != '':
-                    if (
-                        hasattr(obj.__class__, self.get_model_field_name(_column_name))
-                        or hasattr(obj, self.get_model_field_name(_column_name))
-                    ):
-                        _field_name = self.get_model_field_name(_column_name)
-                        model_field = obj._meta.get_field(_field_name)
-                        logger.info("Setting attr %s with value %s" % (_field_name, value))
-                        if isinstance(model_field, fields.DateField):
-                            self.process_date_field(obj, _field_name, value)
-                        elif isinstance(model_field, fields.TimeField):
-                            self.process_time_field(obj, _field_name, value)
-                        elif isinstance(model_field, fields.DateTimeField):
-                            self.process_datetime_field(obj, _field_name, value)
-                        elif isinstance(model_field, fields.related.ForeignKey):
-                            self.process_fk_field(obj, _field_name, _column_name, value)
-                        elif isinstance(model_field, fields.related.ManyToManyField):
-                            new_m2m_map = self.process_m2m_field(obj, _field_name, _column_name, value, _columns)
-                            if new_m2m_map:
-                                m2m_map.update(new_m2m_map)
-                        elif "django_countries" in settings.INSTALLED_APPS and isinstance(model_field, CountryField):
-                            self.process_django_countries_field(obj, _field_name, value)
-                        else:
-                            self.set_model_attr(obj, _field_name, value)
+                    _field_name = column_plan.field_name
+                    if column_plan.kind in ('value', 'fk'):
+                        if self.merge_policy == "first" and _field_name in merged_fields:
+                            continue
+                        merged_fields.add(_field_name)
+                    if column_plan.kind == 'children':
+                        for relation_name, values in column_plan.handler(
+                                obj, _field_name, column_plan.column_name, value, _columns).items():
+                            children_values.setdefault(relation_name, {}).update(values)
+                        continue
+                    if changed_fields is not None and column_plan.kind != 'm2m':
+                        old_value = getattr(obj, column_plan.model_field.attname)
+                    if column_plan.kind == 'fk':
+                        column_plan.handler(obj, _field_name, column_plan.column_name, value)
+                    elif column_plan.kind == 'm2m':
+                        new_m2m_map = column_plan.handler(obj, _field_name, column_plan.column_name, value, _columns)
+                        if new_m2m_map:
+                            m2m_map.update(new_m2m_map)
+                        continue
                     else:
-                        pass
-                        # logger.warning("The model {model} has no field {field}".format(model=self.model,field=self.get_model_field_name(_column_name)))
+                        column_plan.handler(obj, _field_name, value)
+                    if changed_fields is not None:
+                        if getattr(obj, column_plan.model_field.attname) == old_value:
+                            continue
+                        changed_fields.add(_field_name)
+                    if self.is_batching():
+                        self._pending_update_fields.add(_field_name)
+            if self.content_hash_field:
+                content_hash = self._content_hashes.get(import_id) if import_id else None
+                if content_hash is None:
+                    content_hash = self.get_content_hash(_columns)
+                if changed_fields is not None and getattr(obj, self.content_hash_field) != content_hash:
+                    changed_fields.add(self.content_hash_field)
+                setattr(obj, self.content_hash_field, content_hash)
+                if self.is_batching():
+                    self._pending_update_fields.add(self.content_hash_field)
             # print("Saving obj {title}.... with start_date:{start_date}".format(title=obj.title,start_date=obj.start_date))
-            obj.save()
-            if m2m_map:
-                self.add_m2m_objects(obj, m2m_map)
+            self.save_object(obj, m2m_map, import_id=import_id, is_creation=_is_creation,
+                             update_fields=None if changed_fields is None else sorted(changed_fields),
+                             children=self.get_child_objects(obj, children_values))
+            if import_id and self._batch_objects is not None:
+                self._batch_objects[import_id] = {'obj': obj, 'is_creation': _is_creation, 'fields': merged_fields}
         return obj
         # obj.save_m2m()
@@ -0,0 +1,122 @@
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import warnings
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+import numpy as np
+import pandas as pd
+from dateutil.parser import parse
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidValue(object):
+    """ Placeholder of a cell that could not be converted, the row is reported as an error"""
+
+    def __init__(self, column_name, raw_value, error):
+        self.column_name = column_name
+        self.raw_value = raw_value
+        self.error = error
+
+    def __repr__(self):
+        return "<InvalidValue {0}={1!r}: {2}>".format(self.column_name, self.raw_value, self.error)
+
+
+def _is_empty(series):
+    return series.isna() | (series == "") | (series == "NULL")
+
+
+def _with_fallback(series, converted, failed, convert_cell):
+    """ Convert one by one the cells that failed the vectorized conversion"""
+    for index in series.index[failed.to_numpy()]:
+        try:
+            converted.at[index] = convert_cell(series.at[index])
+        except (ValueError, OverflowError, TypeError, InvalidOperation) as ex:
+            converted.at[index] = InvalidValue(series.name, series.at[index], ex)
+    return converted
+
+
+def convert_datetime_series(series, kind="datetime", date_format=None):
+    """
+    Convert a column of strings to datetime, date or time (kind) objects.
+
+    Without date_format every cell is parsed on its own with the dateutil conventions
+    (month first unless the month is over 12), so a value never depends on the other
+    cells of the chunk. Columns pandas cannot convert at once (e.g. timestamps with
+    different UTC offsets) and the cells it failed are converted one by one.
+    Empty cells become "", invalid cells an InvalidValue.
+    """
+    empty = _is_empty(series)
+    try:
+        with warnings.catch_warnings():
+            # Cells pandas cannot parse are handled by the fallback below, "mixed" needs pandas >= 2.0
+            warnings.simplefilter("ignore", UserWarning)
+            parsed = pd.to_datetime(series.where(~empty), format=date_format or "mixed", errors="coerce")
+    except (ValueError, OverflowError, TypeError) as ex:
+        logger.debug("Converting column {0} cell by cell: {1}".format(series.name, ex))
+        converted = pd.Series("", index=series.index, dtype=object)
+        failed = ~empty
+    else:
+        if kind == "date":
+            values = parsed.dt.date
+        elif kind == "time":
+            values = parsed.dt.time
+        else:
+            values = pd.Series([value if pd.isna(value) else value.to_pydatetime() for value in parsed],
+                               index=series.index, dtype=object)
+        converted = pd.Series(np.where(empty, "", values.astype(object)), index=series.index, dtype=object)
+        failed = parsed.isna() & ~empty
+
+    def convert_cell(value):
+        value = datetime.strptime(value, date_format) if date_format else parse(value)
+        return value.date() if kind == "date" else value.time() if kind == "time" else value
+
+    return _with_fallback(series, converted, failed, convert_cell)
+
+
+def _to_decimal(value):
+    # Typed columns (e.g. Parquet) hold numbers, str() gives their shortest representation
+    return Decimal(value.strip() if isinstance(value, str) else str(value))
+
+
+def _to_int(value):
+    # Never through float, which loses the digits of integers over 2**53
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            pass
+    try:
+        number = _to_decimal(value)
+    except InvalidOperation:
+        number = None
+    if number is None or not number.is_finite() or number != number.to_integral_value():
+        raise ValueError("{0!r} is not an integer".format(value))
+    return int(number)
+
+
+def convert_numeric_series(series, kind="float"):
+    """
+    Convert a column of strings to int, float or Decimal (kind) objects.
+    Integers are converted from their text, float and Decimal columns with pd.to_numeric.
+    Empty cells become "", invalid cells an InvalidValue.
+    """
+    empty = _is_empty(series)
+    if kind == "int":
+        return _with_fallback(series, pd.Series("", index=series.index, dtype=object), ~empty, _to_int)
+    parsed = pd.to_numeric(series.where(~empty), errors="coerce")
+    valid = parsed.notna()
+    converted = pd.Series("", index=series.index, dtype=object)
+    if kind == "decimal":
+        # Keep the original text so no precision is lost through float
+        converted[valid] = [_to_decimal(value) for value in series[valid]]
+    else:
+        converted[valid] = [float(value) for value in parsed[valid]]
+    failed = ~valid & ~empty
+
+    def convert_cell(value):
+        return _to_decimal(value) if kind == "decimal" else float(value)
+
+    return _with_fallback(series, converted, failed, convert_cell)
@@ -0,0 +1,63 @@
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import unicodedata
+
+from django.utils import translation
+
+try:
+    from django_countries import countries
+except ImportError:
+    countries = None
+
+logger = logging.getLogger(__name__)
+
+_country_indexes = {}
+
+
+def normalize_country_name(name):
+    """ Case, accent and whitespace insensitive key of a country name"""
+    name = unicodedata.normalize("NFKD", str(name))
+    name = "".join(character for character in name if not unicodedata.combining(character))
+    return " ".join(name.casefold().split())
+
+
+class CountryIndex(object):
+    """
+    Dict index from the normalized names, ISO alpha-2 and alpha-3 codes and aliases
+    to the country codes of django_countries. Unknown names are remembered so
+    each of them is only looked up (and reported) once.
+    """
+
+    def __init__(self, aliases=None):
+        self.codes = {}
+        self.unknown = set()
+        for code, name in countries:
+            self.codes[normalize_country_name(name)] = code
+            self.codes[normalize_country_name(code)] = code
+            alpha3 = countries.alpha3(code)
+            if alpha3:
+                self.codes[normalize_country_name(alpha3)] = code
+        for alias, target in (aliases or {}).items():
+            code = self.codes.get(normalize_country_name(target))
+            if code is None:
+                logger.warning("Country alias {0!r} points to the unknown country {1!r}".format(alias, target))
+            else:
+                self.codes[normalize_country_name(alias)] = code
+
+    def get(self, value):
+        """ Return the code of the country named value, None when it is unknown"""
+        if value in self.unknown:
+            return None
+        code = self.codes.get(normalize_country_name(value))
+        if code is None:
+            self.unknown.add(value)
+        return code
+
+
+def get_country_index(aliases=None):
+    """ CountryIndex of the active language and aliases, built once per process"""
+    key = (translation.get_language(), tuple(sorted((aliases or {}).items())))
+    if key not in _country_indexes:
+        _country_indexes[key] = CountryIndex(aliases=aliases)
+    return _country_indexes[key]
@@ -0,0 +1,148 @@
+from __future__ import absolute_import, unicode_literals
+
+import csv
+import json
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+
+class ErrorCollector(object):
+    """
+    Errors of the imported rows: row number, column, raw value, exception and message.
+
+    The first max_in_memory errors are kept in memory, past them all the errors are spilled
+    to file_path (CSV when it ends with .csv, JSON lines otherwise), a temporary file when it
+    is not set. With file_path every error is written there once the import is finished.
+    Iterating yields the errors as dicts, the ones read back from a file have their values
+    as written (strings in CSV files).
+    """
+    fields = ['row', 'column', 'value', 'exception', 'error']
+
+    def __init__(self, max_in_memory=1000, file_path=None):
+        self.max_in_memory = max_in_memory
+        self.file_path = str(file_path) if file_path else None
+        self.errors = []
+        self.count = 0
+        self._file = None
+        self._writer = None
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return "<ErrorCollector {0} errors>".format(self.count)
+
+    @property
+    def is_csv(self):
+        return bool(self.file_path) and self.file_path.lower().endswith(".csv")
+
+    @property
+    def is_spilled(self):
+        return self._file is not None
+
+    def add(self, row_number, column_name, raw_value, error):
+        self.count += 1
+        entry = {
+            'row': row_number,
+            'column': column_name,
+            'value': raw_value,
+            'exception': type(error).__name__ if isinstance(error, BaseException) else None,
+            'error': str(error),
+        }
+        if self.is_spilled:
+            self.write(entry)
+            return
+        self.errors.append(entry)
+        if self.max_in_memory is not None and len(self.errors) > self.max_in_memory:
+            self.spill()
+
+    def spill(self):
+        """ Move the errors kept in memory to the file"""
+        if self._file is None:
+            if self.file_path:
+                self._file = open(self.file_path, "w", newline="")
+            else:
+                self._file = tempfile.NamedTemporaryFile("w+", newline="", suffix=".jsonl")
+            if self.is_csv:
+                self._writer = csv.DictWriter(self._file, fieldnames=self.fields)
+                self._writer.writeheader()
+            logger.debug("Spilling {0} row errors to {1}".format(self.count, self._file.name))
+        for entry in self.errors:
+            self.write(entry)
+        self.errors = []
+
+    def write(self, entry):
+        if self._writer is not None:
+            self._writer.writerow(entry)
+        else:
+            self._file.write(json.dumps(entry, default=str) + "\n")
+
+    def close(self):
+        """ Write the errors to file_path, the temporary file is kept until the collector is dropped"""
+        if self.file_path:
+            self.spill()
+            self._file.close()
+        elif self._file is not None:
+            self._file.flush()
+
+    def __iter__(self):
+        if self.is_spilled:
+            if not self._file.closed:
+                self._file.flush()
+            with open(self._file.name, newline="") as error_file:
+                if self.is_csv:
+                    for entry in csv.DictReader(error_file):
+                        yield entry
+                else:
+                    for line in error_file:
+                        yield json.loads(line)
+        for entry in self.errors:
+            yield entry
+
+
+class RejectsWriter(object):
+    """
+    CSV file of the rows that could not be imported, written with the header and the
+    delimiter of the importer so that once fixed it can be imported again.
+    Every row is written once, format_value(column_name, value) returns the text of its cells.
+    """
+
+    def __init__(self, file_path, delimiter=";", quotechar='"', append=False, format_value=None):
+        self.file_path = str(file_path)
+        self.format_value = format_value
+        self.delimiter = delimiter
+        self.quotechar = quotechar
+        self.append = append
+        self.count = 0
+        self._file = None
+        self._writer = None
+        self._columns = None
+        self._last_row_number = None
+
+    def open(self, columns):
+        write_header = not (self.append and os.path.exists(self.file_path) and os.path.getsize(self.file_path))
+        self._file = open(self.file_path, "a" if self.append else "w", newline="")
+        self._writer = csv.writer(self._file, delimiter=self.delimiter, quotechar=self.quotechar)
+        self._columns = list(columns)
+        if write_header:
+            self._writer.writerow(self._columns)
+
+    def write(self, row_number, row):
+        if row_number is not None and row_number == self._last_row_number:
+            return
+        if self._file is None:
+            self.open(row.keys())
+        if self.format_value is None:
+            values = ["" if row.get(column_name) is None else row.get(column_name) for column_name in self._columns]
+        else:
+            values = [self.format_value(column_name, row.get(column_name)) for column_name in self._columns]
+        self._writer.writerow(values)
+        self._last_row_number = row_number
+        self.count += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
@@ -0,0 +1,248 @@
+from __future__ import absolute_import, unicode_literals
+
+import bz2
+import gzip
+import io
+import logging
+import lzma
+import os
+import shutil
+import tempfile
+import zipfile
+from contextlib import contextmanager
+from pathlib import Path, PurePath
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .readers import COLUMNAR_EXTENSIONS
+
+logger = logging.getLogger(__name__)
+
+# Suffix of the compressed files and their compression
+COMPRESSION_EXTENSIONS = {
+    "gz": "gzip",
+    "gzip": "gzip",
+    "bz2": "bz2",
+    "xz": "xz",
+    "zst": "zstd",
+    "zstd": "zstd",
+    "zip": "zip",
+}
+COMPRESSION_MAGIC_NUMBERS = [
+    (b"\x1f\x8b", "gzip"),
+    (b"BZh", "bz2"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (b"\x28\xb5\x2f\xfd", "zstd"),
+    (b"PK\x03\x04", "zip"),
+]
+SNIFF_SIZE = 4096
+# Non-seekable streams whose format must be sniffed are copied in memory up to this size, then on disk
+SPOOL_SIZE = 16 * 1024 * 1024
+FILE_EXTENSIONS = ["csv", "xls", "xlsx"] + COLUMNAR_EXTENSIONS
+
+
+def sniff_compression(head):
+    for magic_number, compression in COMPRESSION_MAGIC_NUMBERS:
+        if head.startswith(magic_number):
+            return compression
+    return None
+
+
+def sniff_file_extension(head):
+    """ Guess the format of the (decompressed) content starting with head, csv when nothing matches"""
+    if head.startswith(b"PAR1"):
+        return "parquet"
+    if head.startswith(b"ARROW1") or head.startswith(b"\xff\xff\xff\xff"):
+        return "arrow"
+    if head.startswith(b"\xd0\xcf\x11\xe0"):
+        return "xls"
+    if head.startswith(b"PK\x03\x04"):
+        return "xlsx"
+    return "csv"
+
+
+def is_xlsx_archive(stream):
+    """ XLSX workbooks are zip archives too"""
+    try:
+        return "[Content_Types].xml" in zipfile.ZipFile(stream).namelist()
+    except zipfile.BadZipFile:
+        return False
+
+
+def is_seekable(stream):
+    if getattr(stream, "closed", False):
+        # Closed Django File, opened again when read
+        return True
+    seekable = getattr(stream, "seekable", None)
+    return seekable() if seekable is not None else hasattr(stream, "seek")
+
+
+class EncodedTextStream(io.RawIOBase):
+    """ Binary file object encoding a text file object (e.g. StringIO) on the fly"""
+
+    def __init__(self, stream, encoding="utf-8"):
+        self.stream = stream
+        self.encoding = encoding
+        self.pending = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while len(self.pending) < len(buffer):
+            text = self.stream.read(len(buffer))
+            if not text:
+                break
+            self.pending += text.encode(self.encoding)
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+
+def _open_zstd(stream):
+    try:
+        import zstandard
+    except ImportError:
+        raise ImproperlyConfigured("zstandard is required to import zstd compressed files")
+    return zstandard.ZstdDecompressor().stream_reader(stream)
+
+
+def decompress(stream, compression):
+    """ Return a file object decompressing stream on the fly"""
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=stream)
+    elif compression == "bz2":
+        return bz2.BZ2File(stream)
+    elif compression == "xz":
+        return lzma.LZMAFile(stream)
+    elif compression == "zstd":
+        return _open_zstd(stream)
+    elif compression == "zip":
+        archive = zipfile.ZipFile(stream)
+        members = [member for member in archive.infolist() if not member.is_dir()]
+        if len(members) != 1:
+            raise ValueError("Zip archives must contain exactly one file, found {0}".format(len(members)))
+        return archive.open(members[0])
+    raise ValueError("Unknown compression {0!r}".format(compression))
+
+
+class ImportFile(object):
+    """
+    File to import: a path, a file object (e.g. a Django UploadedFile or File)
+    or the name of a file in storage, optionally compressed.
+
+    The format comes from the extension of its name, once the compression suffix
+    is stripped, or is sniffed from the content when the name does not tell.
+    """
+
+    def __init__(self, file, storage=None):
+        self.file = file
+        self.storage = storage
+        if isinstance(file, (str, PurePath)):
+            self.name = str(file)
+            self.path = None if storage is not None else self.name
+        else:
+            self.name = getattr(file, "name", None) or ""
+            self.path = None
+        self.file_extension, self.compression = self.get_extensions(self.name)
+        if self.path is None and self.storage is None and not is_seekable(self.file) and (
+                self.file_extension != "csv" or self.compression == "zip"):
+            # Only CSV files are read from start to end: zip archives, Excel and columnar files
+            # are read at random, and sniffing reads the head of the stream, it has to be read again
+            self.file = self.spool(self.file)
+        if self.file_extension not in FILE_EXTENSIONS:
+            if self.compression is None:
+                self.compression = sniff_compression(self.read_head(decompressed=False))
+                if self.compression == "zip":
+                    with self.open(decompressed=False, as_path=False) as stream:
+                        if is_xlsx_archive(stream):
+                            self.compression = None
+            self.file_extension = sniff_file_extension(self.read_head())
+            logger.debug("Sniffed format {0} of {1!r}".format(self.file_extension, self))
+
+    def __repr__(self):
+        return "<ImportFile {0}>".format(self.name or self.file)
+
+    def __str__(self):
+        return self.name
+
+    @staticmethod
+    def get_extensions(name):
+        """ Return the format and the compression of name, e.g. ("csv", "gzip") for data.csv.gz"""
+        suffixes = [suffix[1:].lower() for suffix in Path(name).suffixes] if name else []
+        compression = None
+        if suffixes and suffixes[-1] in COMPRESSION_EXTENSIONS:
+            compression = COMPRESSION_EXTENSIONS[suffixes.pop()]
+        return (suffixes[-1] if suffixes else ""), compression
+
+    @property
+    def is_local_path(self):
+        """ The file can be read (or memory mapped) straight from its path"""
+        return self.path is not None and self.compression is None
+
+    @property
+    def can_reopen(self):
+        """ False for non-seekable file objects, which can only be read once"""
+        return self.path is not None or self.storage is not None or is_seekable(self.file)
+
+    @staticmethod
+    def spool(stream):
+        """ Copy a non-seekable stream in a seekable temporary file"""
+        if isinstance(stream.read(0), str):
+            stream = EncodedTextStream(stream)
+        spooled_file = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        shutil.copyfileobj(stream, spooled_file)
+        spooled_file.seek(0)
+        return spooled_file
+
+    def read_head(self, decompressed=True):
+        with self.open(decompressed=decompressed, as_path=False) as stream:
+            return stream.read(SNIFF_SIZE)
+
+    @contextmanager
+    def open(self, decompressed=True, as_path=True):
+        """
+        Yield the path of the file when it can be read from disk (and as_path is set),
+        otherwise a binary file object decompressing it on the fly.
+        Non-seekable file objects are read from their current position, so only once.
+        """
+        if as_path and decompressed and self.is_local_path:
+            yield self.path
+            return
+        opened = []
+        try:
+            if self.path is not None:
+                stream = open(self.path, "rb")
+                opened.append(stream)
+            elif self.storage is not None:
+                stream = self.storage.open(self.name, "rb")
+                opened.append(stream)
+            else:
+                stream = self.file
+                if hasattr(stream, "open") and getattr(stream, "closed", False):
+                    # Closed Django File
+                    stream.open("rb")
+                if is_seekable(stream):
+                    stream.seek(0)
+                if isinstance(stream.read(0), str):
+                    # Text mode file objects, e.g. StringIO or a ContentFile holding a str
+                    stream = io.BufferedReader(EncodedTextStream(stream))
+            if decompressed and self.compression:
+                stream = decompress(stream, self.compression)
+                opened.append(stream)
+            yield stream
+        finally:
+            for stream in reversed(opened):
+                stream.close()
+
+    def get_size(self):
+        if self.path is not None:
+            return os.path.getsize(self.path)
+        return getattr(self.file, "size", None)
+
+
+def get_import_file(file, storage=None):
+    if isinstance(file, ImportFile):
+        return file
+    return ImportFile(file, storage=storage)
@@ -0,0 +1,118 @@
+from __future__ import absolute_import, unicode_literals
+
+import cProfile
+import io
+import logging
+import pstats
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from . import signals
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsCollector(object):
+    """
+    Local metrics sink keeping every sample by name, like a StatsD or Prometheus client would.
+    Pass it (or any callable taking a name and a value) as metrics_sink.
+    """
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def __call__(self, name, value):
+        self.samples[name].append(value)
+
+    def total(self, name):
+        return sum(self.samples.get(name, []))
+
+
+class ImportMetrics(object):
+    """
+    Per-phase timings and query counts of one import.
+
+    It is installed as execute_wrapper of the import connection so every query
+    is counted in the phase running when it is executed.
+    """
+    prefix = "django_model_importer"
+
+    def __init__(self, importer, sink=None, profile=None):
+        self.importer = importer
+        self.sink = sink
+        self.profile = profile
+        self.profiler = cProfile.Profile() if profile else None
+        self.phases = defaultdict(lambda: {'time': 0.0, 'queries': 0, 'calls': 0})
+        self.current_phase = None
+        self.queries = 0
+        self.wall_time = 0.0
+        self._start = None
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        if self.current_phase:
+            self.phases[self.current_phase]['queries'] += 1
+        return execute(sql, params, many, context)
+
+    def start(self):
+        self._start = time.perf_counter()
+        if self.profiler:
+            self.profiler.enable()
+
+    def finish(self, result):
+        if self.profiler:
+            self.profiler.disable()
+            if isinstance(self.profile, str):
+                self.profiler.dump_stats(self.profile)
+        self.wall_time = time.perf_counter() - self._start
+        self.emit("wall_time", self.wall_time)
+        self.emit("queries", self.queries)
+        for counter in ['rows', 'imported', 'errors']:
+            self.emit(counter, result[counter])
+        if self.wall_time:
+            self.emit("rows_per_second", result['rows'] / self.wall_time)
+
+    @contextmanager
+    def phase(self, name):
+        parent_phase, self.current_phase = self.current_phase, name
+        queries = self.queries
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self.current_phase = parent_phase
+            phase = self.phases[name]
+            phase['time'] += duration
+            phase['calls'] += 1
+            if parent_phase:
+                # Nested phases are not counted twice
+                self.phases[parent_phase]['time'] -= duration
+            self.emit("{0}.time".format(name), duration)
+            self.emit("{0}.queries".format(name), self.queries - queries)
+            signals.import_phase_finished.send(
+                sender=self.importer.__class__, importer=self.importer, phase=name,
+                duration=duration, queries=self.queries - queries)
+
+    def emit(self, name, value):
+        if self.sink is not None:
+            self.sink("{0}.{1}".format(self.prefix, name), value)
+
+    def get_profile_stats(self, limit=30):
+        if not self.profiler:
+            return None
+        stream = io.StringIO()
+        pstats.Stats(self.profiler, stream=stream).sort_stats("cumulative").print_stats(limit)
+        return stream.getvalue()
+
+    def as_dict(self, result):
+        metrics = {
+            'wall_time': self.wall_time,
+            'queries': self.queries,
+            'rows_per_second': result['rows'] / self.wall_time if self.wall_time else None,
+            'phases': {name: dict(phase) for name, phase in self.phases.items()},
+        }
+        if self.profiler:
+            metrics['profile'] = self.get_profile_stats()
+        return metrics
@@ -0,0 +1,117 @@
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import multiprocessing
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import partial
+from itertools import count
+
+from django.core.exceptions import ImproperlyConfigured
+
+logger = logging.getLogger(__name__)
+
+# Importer instance of the current worker process, built on its first chunk
+_worker_importer = None
+
+
+def get_partition(key, partitions):
+    """ Stable partition of key, the builtin hash() of strings changes between processes"""
+    return zlib.crc32(str(key).encode("utf-8")) % partitions
+
+
+def partition_rows(importer, numbered_rows, partitions):
+    """
+    Split (row_number, row) pairs in partitions lists, rows with the same
+    importer.get_partition_key() always end up in the same partition
+    """
+    partitioned_rows = [[] for _ in range(partitions)]
+    for position, (row_number, row) in enumerate(numbered_rows):
+        key = importer.get_partition_key(row)
+        partition = position % partitions if key is None or key == "" else get_partition(key, partitions)
+        partitioned_rows[partition].append((row_number, row))
+    return partitioned_rows
+
+
+def _begin_immediate(connection):
+    connection.cursor().execute("BEGIN IMMEDIATE")
+
+
+def _init_worker():
+    import django
+    from django.apps import apps
+    from django.db import connections
+
+    if not apps.ready:
+        # Workers started with "spawn" do not inherit the configured Django
+        django.setup()
+    connections.close_all()
+    for connection in connections.all():
+        if connection.vendor == "sqlite" and not connection.settings_dict["OPTIONS"].get("transaction_mode"):
+            # SQLite has a single writer: a chunk reading before writing fails with "database is locked"
+            # while another worker commits, unless its transaction takes the write lock first
+            # (transaction_mode "IMMEDIATE" of Django >= 5.1)
+            connection._start_transaction_under_autocommit = partial(_begin_immediate, connection)
+
+
+def _import_chunk(importer_class, init_kwargs, batch_size, numbered_rows, import_kwargs):
+    from django.db import transaction
+
+    global _worker_importer
+    if _worker_importer is None or not isinstance(_worker_importer, importer_class):
+        _worker_importer = importer_class(**init_kwargs)
+        _worker_importer.start_batch(batch_size)
+    with transaction.atomic(using=_worker_importer.get_db_alias()):
+        return _worker_importer.import_rows(numbered_rows, **import_kwargs)
+
+
+def import_batches_in_parallel(importer, batches, workers, batch_size=None, from_row=1, **kwargs):
+    """
+    Import batches with workers processes, each with its own connection and one
+    transaction per chunk. Every worker has its own executor so the chunks holding
+    the same partition key are imported one after the other by the same process.
+    The rows are numbered from from_row. Returns the rows, imported and errors counters.
+    The related objects shared by the partitions of each batch are created first by this process.
+    It cannot run inside a transaction: the workers commit their chunks on their own connections.
+    """
+    from django.db import connections
+
+    if any(connection.in_atomic_block for connection in connections.all()):
+        raise ImproperlyConfigured("The parallel import cannot run inside a transaction, "
+                                   "its workers commit their chunks on their own connections")
+    mp_context = multiprocessing.get_context(importer.workers_start_method) if importer.workers_start_method else None
+    init_kwargs = importer.get_worker_init_kwargs()
+    executors = [ProcessPoolExecutor(max_workers=1, initializer=_init_worker, mp_context=mp_context)
+                 for _ in range(workers)]
+    pending = set()
+    row_count = imported_number = error_number = 0
+    row_numbers = count(from_row)
+    try:
+        for rows in batches:
+            numbered_rows = [(next(row_numbers), row) for row in rows]
+            row_count += len(rows)
+            importer.prepare_shared_objects(rows)
+            # Forked workers must not share the connections of the parent
+            connections.close_all()
+            for executor, partition in zip(executors, partition_rows(importer, numbered_rows, workers)):
+                if partition:
+                    pending.add(executor.submit(
+                        _import_chunk, importer.__class__, init_kwargs, batch_size, partition, kwargs))
+            # Bound the chunks waiting in memory
+            while len(pending) > workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    imported, errors = future.result()
+                    imported_number += imported
+                    error_number += errors
+                importer.report_progress(imported_number + error_number, imported_number, error_number)
+        for future in wait(pending).done:
+            imported, errors = future.result()
+            imported_number += imported
+            error_number += errors
+        importer.report_progress(row_count, imported_number, error_number)
+    finally:
+        for executor in executors:
+            executor.shutdown(wait=True)
+    logger.debug("Imported {0} rows with {1} workers".format(row_count, workers))
+    return row_count, imported_number, error_number
@@ -0,0 +1,132 @@
+from __future__ import absolute_import, unicode_literals
+
+import logging
+from contextlib import ExitStack
+
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc  # noqa: F401
+    import pyarrow.parquet  # noqa: F401
+except ImportError:
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+# Feather (v2) files are Arrow IPC files
+COLUMNAR_EXTENSIONS = ["parquet", "feather", "arrow", "ipc"]
+
+
+def _get_existing_columns(column_names, columns):
+    if columns is None:
+        return None
+    return [column_name for column_name in columns if column_name in column_names]
+
+
+def iter_parquet_batches(file_path, columns=None, chunk_size=None, skip_rows=0, memory_map=True):
+    """
+    Yield a Table per row group of a Parquet file, or RecordBatches of chunk_size rows.
+    Only columns are read and the row groups before skip_rows are not read at all.
+    """
+    parquet_file = pa.parquet.ParquetFile(file_path, memory_map=memory_map)
+    columns = _get_existing_columns(parquet_file.schema_arrow.names, columns)
+    row_groups = []
+    for row_group in range(parquet_file.num_row_groups):
+        num_rows = parquet_file.metadata.row_group(row_group).num_rows
+        if skip_rows >= num_rows:
+            skip_rows -= num_rows
+        else:
+            row_groups.append(row_group)
+    if chunk_size:
+        batches = parquet_file.iter_batches(batch_size=chunk_size, row_groups=row_groups, columns=columns)
+    else:
+        batches = (parquet_file.read_row_group(row_group, columns=columns) for row_group in row_groups)
+    for batch in batches:
+        if skip_rows >= batch.num_rows:
+            skip_rows -= batch.num_rows
+            continue
+        if skip_rows:
+            batch, skip_rows = batch.slice(skip_rows), 0
+        yield batch
+
+
+def iter_ipc_batches(file_path, columns=None, chunk_size=None, skip_rows=0, memory_map=True):
+    """ Yield the RecordBatches of an Arrow IPC (Feather) file or stream, sliced in chunk_size rows"""
+    with ExitStack() as stack:
+        if isinstance(file_path, str):
+            source = stack.enter_context(pa.memory_map(file_path) if memory_map else pa.OSFile(file_path))
+        else:
+            # File object, closed by its owner
+            source = pa.PythonFile(file_path, mode="r")
+        try:
+            reader = pa.ipc.open_file(source)
+            batches = (reader.get_batch(index) for index in range(reader.num_record_batches))
+        except pa.ArrowInvalid:
+            source.seek(0)
+            reader = pa.ipc.open_stream(source)
+            batches = iter(reader)
+        columns = _get_existing_columns(reader.schema.names, columns)
+        for batch in batches:
+            if skip_rows >= batch.num_rows:
+                skip_rows -= batch.num_rows
+                continue
+            if skip_rows:
+                batch, skip_rows = batch.slice(skip_rows), 0
+            if columns is not None:
+                batch = batch.select(columns)
+            if not chunk_size:
+                yield batch
+                continue
+            for offset in range(0, batch.num_rows, chunk_size):
+                yield batch.slice(offset, chunk_size)
+
+
+def iter_columnar_batches(file_path, file_extension, columns=None, chunk_size=None, skip_rows=0, memory_map=True):
+    """ Yield the pyarrow batches of a Parquet, Feather or Arrow IPC file"""
+    if pa is None:
+        raise ImproperlyConfigured("pyarrow is required to import {0} files".format(file_extension))
+    if file_extension == "parquet":
+        return iter_parquet_batches(file_path, columns=columns, chunk_size=chunk_size, skip_rows=skip_rows,
+                                    memory_map=memory_map)
+    return iter_ipc_batches(file_path, columns=columns, chunk_size=chunk_size, skip_rows=skip_rows,
+                            memory_map=memory_map)
+
+
+def skip_data_frame_rows(data_frames, rows):
+    """
+    Yield data_frames without their first rows. The rows are counted once parsed,
+    so blank lines and multiline cells do not shift them as skiprows does.
+    """
+    for data_frame in data_frames:
+        if rows:
+            skipped = min(rows, len(data_frame))
+            rows -= skipped
+            data_frame = data_frame.iloc[skipped:].reset_index(drop=True)
+            if data_frame.empty:
+                continue
+        yield data_frame
+
+
+def iter_excel_rows(file_path, sheet_name=0):
+    """
+    Yield the header and the rows (tuples of cell values) of an XLSX sheet, sheet_name
+    is its index or its name. The workbook is read in read-only mode, one row at a time.
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        worksheet = workbook.worksheets[sheet_name] if isinstance(sheet_name, int) else workbook[sheet_name]
+        rows = worksheet.iter_rows(values_only=True)
+        header = list(next(rows, ()))
+        # Trailing empty header cells are formatting, not columns
+        while header and header[-1] is None:
+            header.pop()
+        yield header
+        for row in rows:
+            row = row[:len(header)]
+            if any(value is not None for value in row):
+                yield row
+    finally:
+        workbook.close()
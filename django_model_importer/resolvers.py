@@ -0,0 +1,174 @@
+from __future__ import absolute_import, unicode_literals
+
+import logging
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+def get_max_query_params(queryset, default=900):
+    return connections[queryset.db].features.max_query_params or default
+
+
+def filter_in_chunks(queryset, field_name, values):
+    """
+    Yield the objects of queryset whose field_name is one of values,
+    splitting the IN clause so it stays below the backend query params limit
+    """
+    values = list(values)
+    chunk_size = get_max_query_params(queryset)
+    for start in range(0, len(values), chunk_size):
+        lookup = {"{0}__in".format(field_name): values[start:start + chunk_size]}
+        for obj in queryset.filter(**lookup):
+            yield obj
+
+
+class ObjectIndex(object):
+    """
+    In-memory index of the model instances keyed by the value of one field.
+
+    prefetch() loads all the instances matching a set of values with a few
+    set-based queries, get() then answers from memory and only falls back
+    to a single query for values that were not prefetched.
+    Values known to have no match are remembered as well.
+    With max_size the least recently used entries are evicted.
+    """
+
+    def __init__(self, model, field_name, queryset=None, max_size=None):
+        self.model = model
+        self.field_name = field_name
+        self.queryset = queryset if queryset is not None else model._default_manager.all()
+        self.max_size = max_size
+        try:
+            self.field = model._meta.get_field(field_name)
+        except FieldDoesNotExist:
+            # Lookups spanning relations (e.g. "profile__code") are resolved one by one
+            self.field = None
+        self.objects = OrderedDict()
+
+    def __len__(self):
+        return len(self.objects)
+
+    def get_key(self, value):
+        if self.field is None:
+            return value
+        try:
+            return self.field.to_python(value)
+        except ValidationError:
+            return value
+
+    def _store(self, key, obj):
+        self.objects[key] = obj
+        self.objects.move_to_end(key)
+        if self.max_size and len(self.objects) > self.max_size:
+            self.objects.popitem(last=False)
+
+    def _missing_keys(self, values):
+        keys = OrderedDict()
+        for value in values:
+            if value is None or value == "":
+                continue
+            key = self.get_key(value)
+            if key not in self.objects:
+                keys[key] = None
+        return list(keys)
+
+    def prefetch(self, values):
+        """ Load the objects matching values, returns the keys without a match"""
+        if self.field is None:
+            return []
+        keys = self._missing_keys(values)
+        if self.max_size and len(keys) > self.max_size:
+            logger.debug("Prefetching only {0} of {1} values for {2}.{3}".format(
+                self.max_size, len(keys), self.model.__name__, self.field_name))
+            keys = keys[:self.max_size]
+        if not keys:
+            return []
+        found = {}
+        for obj in filter_in_chunks(self.queryset, self.field_name, keys):
+            found.setdefault(getattr(obj, self.field.attname), obj)
+        for key in keys:
+            self._store(key, found.get(key))
+        logger.debug("Prefetched {0} of {1} values for {2}.{3}".format(
+            len(found), len(keys), self.model.__name__, self.field_name))
+        return [key for key in keys if key not in found]
+
+    def get(self, value):
+        key = self.get_key(value)
+        if key in self.objects:
+            self.objects.move_to_end(key)
+            obj = self.objects[key]
+            if obj is None:
+                raise self.model.DoesNotExist(
+                    "{0} matching {1}={2!r} does not exist.".format(
+                        self.model._meta.object_name, self.field_name, value))
+            return obj
+        try:
+            obj = self.queryset.get(**{self.field_name: value})
+        except self.model.DoesNotExist:
+            self._store(key, None)
+            raise
+        self._store(key, obj)
+        return obj
+
+    def add(self, value, obj):
+        self._store(self.get_key(value), obj)
+
+    def discard(self, value):
+        """ Forget value, the next get() queries it again"""
+        self.objects.pop(self.get_key(value), None)
+
+    def clear(self):
+        self.objects = OrderedDict()
+
+
+class ImportIdIndex(ObjectIndex):
+    """ Index of the imported model instances keyed by import id"""
+
+
+class RelatedObjectResolver(ObjectIndex):
+    """
+    Resolve the values of a related column (e.g. "user__username") to instances
+    of the related model, creating the missing ones when allowed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(RelatedObjectResolver, self).__init__(*args, **kwargs)
+        self.created_keys = []
+
+    def prefetch(self, values, create_missing=False):
+        missing_keys = super(RelatedObjectResolver, self).prefetch(values)
+        if missing_keys and create_missing:
+            self.bulk_create(missing_keys)
+            missing_keys = []
+        return missing_keys
+
+    def bulk_create(self, keys):
+        self.queryset.bulk_create([self.model(**{self.field_name: key}) for key in keys],
+                                  ignore_conflicts=True)
+        # Primary keys are not set by bulk_create on every backend, reload the new rows
+        for key in keys:
+            self.objects.pop(key, None)
+        created = super(RelatedObjectResolver, self).prefetch(keys)
+        logger.debug("Created {0} {1} objects".format(len(keys) - len(created), self.model.__name__))
+
+    def resolve(self, value, create=False):
+        try:
+            return self.get(value)
+        except self.model.DoesNotExist:
+            if not create:
+                raise
+        key = self.get_key(value)
+        obj = self.queryset.create(**{self.field_name: key})
+        self._store(key, obj)
+        self.created_keys.append(key)
+        return obj
+
+    def forget_created(self):
+        """ Evict the objects created one by one by resolve(), e.g. after a rollback"""
+        for key in self.created_keys:
+            self.objects.pop(key, None)
+        self.created_keys = []
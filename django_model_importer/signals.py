@@ -0,0 +1,8 @@
+from django.dispatch import Signal
+
+# Sent with importer and file_path before the first row is read
+import_started = Signal()
+# Sent with importer, phase, duration (seconds) and queries every time a phase ends
+import_phase_finished = Signal()
+# Sent with importer, result and metrics (None unless collected) after the last row
+import_finished = Signal()
@@ -0,0 +1,45 @@
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import time
+
+
+class RowTracer(object):
+    """
+    Sampled and rate limited per-row trace of an import.
+
+    Only one row every sample_every (and at most max_per_second lines a second)
+    is logged at level. When neither is set, or the logger does not accept
+    level, enabled is False and the importer never calls the tracer.
+    """
+
+    def __init__(self, logger, sample_every=None, max_per_second=None, level=logging.DEBUG):
+        self.logger = logger
+        self.sample_every = sample_every
+        self.max_per_second = max_per_second
+        self.level = level
+        self.enabled = bool(sample_every or max_per_second) and logger.isEnabledFor(level)
+        self.rows = 0
+        self.skipped = 0
+        self._window_start = time.monotonic()
+        self._window_count = 0
+
+    def _accept(self):
+        self.rows += 1
+        if self.sample_every and (self.rows - 1) % self.sample_every:
+            return False
+        if self.max_per_second:
+            now = time.monotonic()
+            if now - self._window_start >= 1:
+                self._window_start, self._window_count = now, 0
+            if self._window_count >= self.max_per_second:
+                self.skipped += 1
+                return False
+            self._window_count += 1
+        return True
+
+    def trace(self, row_number, message, **fields):
+        if not self._accept():
+            return
+        self.logger.log(self.level, "Row %s: %s %s", row_number, message, fields,
+                        extra={'import_row': dict(fields, row_number=row_number, message=message)})
@@ -0,0 +1,153 @@
+from __future__ import absolute_import, unicode_literals
+
+import io
+import logging
+
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+
+class ObjectWriter(object):
+    """
+    Writes the objects of a batch that have no m2m relations, see ModelCSVImporter.writer_class.
+    This default writer uses bulk_create and bulk_update.
+    """
+
+    def __init__(self, model, using, batch_size=None):
+        self.model = model
+        self.using = using
+        self.batch_size = batch_size
+        self.connection = connections[using]
+
+    def write(self, to_create, to_update, update_fields, conflict_field=None):
+        """
+        Insert to_create and update update_fields of to_update.
+        conflict_field is a unique field the writer may merge the rows on.
+        """
+        if to_create:
+            self.model._default_manager.db_manager(self.using).bulk_create(to_create, batch_size=self.batch_size)
+        if to_update and update_fields:
+            self.model._default_manager.db_manager(self.using).bulk_update(
+                to_update, update_fields, batch_size=self.batch_size)
+
+
+class CopyWriter(ObjectWriter):
+    """
+    PostgreSQL writer streaming the rows with COPY ... FROM STDIN.
+
+    New objects are copied straight into the model table. When a unique
+    conflict_field is given, the objects are copied into a temporary staging
+    table and merged with INSERT ... ON CONFLICT (conflict_field) DO UPDATE.
+    On other databases it behaves like ObjectWriter.
+
+    psycopg 3 adapts the values of the copied rows, with psycopg2 they are formatted as text,
+    so models with fields that are not in text_field_types (arrays, binary, JSON, ranges...)
+    are written like ObjectWriter.
+    """
+    staging_table_suffix = "_import_staging"
+    # Internal types of the fields whose database value is valid COPY text once passed to str()
+    text_field_types = {
+        "AutoField", "BigAutoField", "SmallAutoField", "BooleanField", "NullBooleanField",
+        "IntegerField", "BigIntegerField", "SmallIntegerField", "PositiveIntegerField",
+        "PositiveBigIntegerField", "PositiveSmallIntegerField", "FloatField", "DecimalField",
+        "CharField", "TextField", "SlugField", "EmailField", "URLField", "FilePathField", "FileField",
+        "GenericIPAddressField", "UUIDField", "DateField", "DateTimeField", "TimeField",
+    }
+
+    def is_supported(self):
+        return self.connection.vendor == "postgresql"
+
+    def uses_psycopg2(self):
+        return self.connection.Database.__name__ == "psycopg2"
+
+    def is_text_field(self, field):
+        while field.is_relation:
+            field = field.target_field
+        return field.get_internal_type() in self.text_field_types
+
+    def can_copy(self):
+        return self.is_supported() and (not self.uses_psycopg2() or all(
+            self.is_text_field(field) for field in self.model._meta.concrete_fields))
+
+    def write(self, to_create, to_update, update_fields, conflict_field=None):
+        if not self.can_copy():
+            return super(CopyWriter, self).write(to_create, to_update, update_fields, conflict_field=conflict_field)
+        if conflict_field and self.model._meta.get_field(conflict_field).unique:
+            self.merge(to_create + to_update, conflict_field, update_fields)
+        else:
+            self.copy(self.model._meta.db_table, to_create, self.get_copy_fields(to_create))
+            super(CopyWriter, self).write([], to_update, update_fields)
+
+    def get_copy_fields(self, objs):
+        """ Concrete fields of the rows, auto primary keys are left to the database"""
+        auto_field = self.model._meta.auto_field
+        return [
+            field for field in self.model._meta.concrete_fields
+            if not (field is auto_field and all(obj.pk is None for obj in objs))
+        ]
+
+    def get_db_row(self, obj, copy_fields):
+        return [field.get_db_prep_save(field.pre_save(obj, obj.pk is None), self.connection) for field in copy_fields]
+
+    def get_copy_row(self, obj, copy_fields):
+        return [self.get_copy_value(value) for value in self.get_db_row(obj, copy_fields)]
+
+    def get_copy_value(self, value):
+        """ Format a scalar value for COPY in text format"""
+        if value is None:
+            return "\\N"
+        if isinstance(value, bool):
+            return "t" if value else "f"
+        return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+    def copy(self, table_name, objs, copy_fields):
+        if not objs:
+            return
+        quote_name = self.connection.ops.quote_name
+        sql = "COPY {0} ({1}) FROM STDIN".format(
+            quote_name(table_name), ", ".join(quote_name(field.column) for field in copy_fields))
+        with self.connection.cursor() as cursor:
+            raw_cursor = cursor.cursor
+            if hasattr(raw_cursor, "copy_expert"):
+                # psycopg2
+                buffer = io.StringIO()
+                for obj in objs:
+                    buffer.write("\t".join(self.get_copy_row(obj, copy_fields)))
+                    buffer.write("\n")
+                buffer.seek(0)
+                raw_cursor.copy_expert(sql, buffer)
+            else:
+                # psycopg 3, adapting the values as in the other queries
+                with raw_cursor.copy(sql) as copy:
+                    for obj in objs:
+                        copy.write_row(self.get_db_row(obj, copy_fields))
+        logger.debug("Copied %s rows in %s", len(objs), table_name)
+
+    def merge(self, objs, conflict_field, update_fields):
+        if not objs:
+            return
+        quote_name = self.connection.ops.quote_name
+        auto_field = self.model._meta.auto_field
+        # Rows are matched on conflict_field, the primary key is never merged
+        copy_fields = [field for field in self.model._meta.concrete_fields if field is not auto_field]
+        table_name = self.model._meta.db_table
+        staging_table_name = table_name + self.staging_table_suffix
+        columns = ", ".join(quote_name(field.column) for field in copy_fields)
+        conflict_column = self.model._meta.get_field(conflict_field).column
+        update_columns = [self.model._meta.get_field(field_name).column for field_name in update_fields
+                          if field_name != conflict_field and not self.model._meta.get_field(field_name).primary_key]
+        if update_columns:
+            on_conflict = "DO UPDATE SET {0}".format(", ".join(
+                "{0} = EXCLUDED.{0}".format(quote_name(column)) for column in update_columns))
+        else:
+            on_conflict = "DO NOTHING"
+        with transaction.atomic(using=self.using), self.connection.cursor() as cursor:
+            cursor.execute("CREATE TEMPORARY TABLE {0} ON COMMIT DROP AS SELECT {1} FROM {2} WITH NO DATA".format(
+                quote_name(staging_table_name), columns, quote_name(table_name)))
+            self.copy(staging_table_name, objs, copy_fields)
+            cursor.execute("INSERT INTO {0} ({1}) SELECT {1} FROM {2} ON CONFLICT ({3}) {4}".format(
+                quote_name(table_name), columns, quote_name(staging_table_name), quote_name(conflict_column),
+                on_conflict))
+            cursor.execute("DROP TABLE {0}".format(quote_name(staging_table_name)))
+        logger.debug("Merged %s rows in %s on %s", len(objs), table_name, conflict_field)
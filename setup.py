@@ -58,6 +58,10 @@ setup(
     ],
     include_package_data=True,
     install_requires=requirements,
+    extras_require={
+        'pyarrow': ['pyarrow'],
+        'zstd': ['zstandard'],
+    },
     license="MIT",
     zip_safe=False,
     keywords='django-model-importer',
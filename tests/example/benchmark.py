@@ -0,0 +1,139 @@
+"""
+Import benchmark for django_model_importer.
+
+Generates synthetic poll files and imports them with PollsImporter, measuring
+rows/sec, queries, peak memory and the wall time of each phase.
+Run it with ``python manage.py benchmark_import --help``.
+"""
+import csv
+import json
+import platform
+import tracemalloc
+
+import django
+import factory
+import pandas as pd
+from django.db import connection, transaction
+from faker import Faker
+
+import django_model_importer
+from tests.example.factories import PollCategoryFactory, UserFactory
+from tests.example.importer import PollsImporter
+
+
+def generate_poll_rows(rows, users=50, categories=20, categories_per_row=2, extra_columns=0, seed=0):
+    """ Yield the header and the rows of a synthetic PollsImporter file"""
+    faker = Faker()
+    faker.seed_instance(seed)
+    usernames = ["user{0}".format(index) for index in range(users)]
+    category_names = ["category{0}".format(index) for index in range(categories)]
+    header = ["Titolo", "Utente", "Categoria", "Domanda"]
+    header += ["Extra {0}".format(index) for index in range(extra_columns)]
+    yield header
+    for index in range(rows):
+        row = [
+            faker.sentence(nb_words=4),
+            usernames[index % users],
+            PollsImporter.m2m_separator.join(
+                category_names[(index + offset) % categories] for offset in range(categories_per_row)),
+            faker.sentence(nb_words=8),
+        ]
+        row += [faker.word() for _ in range(extra_columns)]
+        yield row
+
+
+def write_poll_file(file_path, file_format="csv", **kwargs):
+    rows = generate_poll_rows(**kwargs)
+    if file_format == "xlsx":
+        header = next(rows)
+        pd.DataFrame(list(rows), columns=header).to_excel(file_path, index=False)
+    else:
+        with open(file_path, "w", newline="") as poll_file:
+            writer = csv.writer(poll_file, delimiter=PollsImporter.delimiter, quotechar=PollsImporter.quotechar)
+            writer.writerows(rows)
+    return file_path
+
+
+def import_file(file_path, importer_class, existing_users, existing_categories, import_kwargs, keep=False,
+                trace_memory=False):
+    """
+    Import file_path in a transaction, rolled back unless keep is True.
+    With trace_memory return the peak of the memory allocated by the import as well
+    (Python objects and numpy/pandas buffers), traced from this import only.
+    """
+    was_tracing = tracemalloc.is_tracing()
+    if trace_memory and not was_tracing:
+        tracemalloc.start()
+    try:
+        with transaction.atomic():
+            UserFactory.create_batch(existing_users, username=factory.Sequence("user{0}".format))
+            PollCategoryFactory.create_batch(existing_categories, name=factory.Sequence("category{0}".format))
+            if trace_memory:
+                tracemalloc.reset_peak()
+                start_memory = tracemalloc.get_traced_memory()[0]
+            result = importer_class().import_csv(file_path, **import_kwargs)
+            peak_memory = tracemalloc.get_traced_memory()[1] - start_memory if trace_memory else None
+            if not keep:
+                transaction.set_rollback(True)
+    finally:
+        if trace_memory and not was_tracing:
+            tracemalloc.stop()
+    return result, peak_memory
+
+
+def run_benchmark(file_path, importer_class=PollsImporter, existing_users=0, existing_categories=0,
+                  import_kwargs=None, keep=False, measure_memory=True):
+    """
+    Import file_path and return the measures, the changes are rolled back unless keep is True.
+    Tracing the memory slows the import down, so with measure_memory its peak is measured
+    by importing the file once more, always rolled back, after the timed import.
+    """
+    import_kwargs = dict(import_kwargs or {}, metrics=True)
+    result, _ = import_file(file_path, importer_class, existing_users, existing_categories, import_kwargs, keep=keep)
+    peak_memory = None
+    if measure_memory:
+        _, peak_memory = import_file(
+            file_path, importer_class, existing_users, existing_categories, import_kwargs, trace_memory=True)
+    metrics = result.pop("metrics")
+    return {
+        "result": result,
+        "wall_time": metrics["wall_time"],
+        "rows_per_second": metrics["rows_per_second"],
+        "queries": metrics["queries"],
+        "peak_memory": peak_memory,
+        "phases": {phase: measures["time"] for phase, measures in metrics["phases"].items()},
+    }
+
+
+def get_environment():
+    return {
+        "django_model_importer": django_model_importer.__version__,
+        "django": django.get_version(),
+        "pandas": pd.__version__,
+        "python": platform.python_version(),
+        "database": connection.vendor,
+    }
+
+
+def compare_results(current, baseline, tolerance=0.1):
+    """
+    Return the regressions of current against baseline: rows/sec dropping or
+    queries growing by more than tolerance (a fraction)
+    """
+    regressions = []
+    for name, run in current["runs"].items():
+        baseline_run = baseline.get("runs", {}).get(name)
+        if not baseline_run:
+            continue
+        if baseline_run["rows_per_second"] and \
+                run["rows_per_second"] < baseline_run["rows_per_second"] * (1 - tolerance):
+            regressions.append("{0}: rows/sec {1:.0f} < {2:.0f}".format(
+                name, run["rows_per_second"], baseline_run["rows_per_second"]))
+        if run["queries"] > baseline_run["queries"] * (1 + tolerance):
+            regressions.append("{0}: queries {1} > {2}".format(name, run["queries"], baseline_run["queries"]))
+    return regressions
+
+
+def save_results(results, output_path):
+    with open(output_path, "w") as output_file:
+        json.dump(results, output_file, indent=2, sort_keys=True)
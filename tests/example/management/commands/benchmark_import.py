@@ -0,0 +1,75 @@
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tests.example.benchmark import (
+    compare_results, get_environment, run_benchmark, save_results, write_poll_file,
+)
+
+
+class Command(BaseCommand):
+    help = "Benchmark PollsImporter on synthetic files, e.g. --rows 100000 --batch-size 1000 --output bench.json"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=10000)
+        parser.add_argument("--format", choices=["csv", "xlsx"], default="csv")
+        parser.add_argument("--extra-columns", type=int, default=0,
+                            help="Unmapped columns added to every row")
+        parser.add_argument("--users", type=int, default=50, help="Distinct users (FK cardinality)")
+        parser.add_argument("--categories", type=int, default=20, help="Distinct categories (M2M cardinality)")
+        parser.add_argument("--categories-per-row", type=int, default=2)
+        parser.add_argument("--existing", type=float, default=0.5,
+                            help="Fraction of users and categories already in the database")
+        parser.add_argument("--batch-size", type=int, action="append", dest="batch_sizes",
+                            help="Batch size to benchmark, repeat it for more runs, 0 disables batching")
+        parser.add_argument("--chunk-size", type=int, default=None)
+        parser.add_argument("--output", help="JSON file where the results are written")
+        parser.add_argument("--compare", help="JSON results of a previous run to compare with")
+        parser.add_argument("--tolerance", type=float, default=0.1)
+        parser.add_argument("--keep", action="store_true", help="Keep the imported rows")
+        parser.add_argument("--no-memory", action="store_false", dest="measure_memory",
+                            help="Do not import the file once more to measure its peak memory")
+
+    def handle(self, *args, **options):
+        fd, file_path = tempfile.mkstemp(suffix="." + options["format"])
+        os.close(fd)
+        try:
+            write_poll_file(
+                file_path, file_format=options["format"], rows=options["rows"], users=options["users"],
+                categories=options["categories"], categories_per_row=options["categories_per_row"],
+                extra_columns=options["extra_columns"])
+            results = {
+                "environment": get_environment(),
+                "parameters": {key: options[key] for key in [
+                    "rows", "format", "extra_columns", "users", "categories", "categories_per_row",
+                    "existing", "chunk_size"]},
+                "runs": {},
+            }
+            for batch_size in options["batch_sizes"] or [0]:
+                name = "batch_size={0}".format(batch_size or None)
+                run = run_benchmark(
+                    file_path,
+                    existing_users=int(options["users"] * options["existing"]),
+                    existing_categories=int(options["categories"] * options["existing"]),
+                    import_kwargs={"batch_size": batch_size or None, "chunk_size": options["chunk_size"]},
+                    keep=options["keep"],
+                    measure_memory=options["measure_memory"],
+                )
+                results["runs"][name] = run
+                self.stdout.write("{0}: {1:.0f} rows/sec, {2} queries, {3} peak memory, phases {4}".format(
+                    name, run["rows_per_second"], run["queries"],
+                    "-" if run["peak_memory"] is None else "{0:.1f} MB".format(run["peak_memory"] / 1024 / 1024),
+                    ", ".join("{0}={1:.2f}s".format(phase, seconds)
+                              for phase, seconds in sorted(run["phases"].items()))))
+        finally:
+            os.remove(file_path)
+        if options["output"]:
+            save_results(results, options["output"])
+        if options["compare"]:
+            import json
+            with open(options["compare"]) as baseline_file:
+                regressions = compare_results(results, json.load(baseline_file), tolerance=options["tolerance"])
+            if regressions:
+                raise CommandError("Performance regressions:\n" + "\n".join(regressions))
+            self.stdout.write(self.style.SUCCESS("No performance regression"))
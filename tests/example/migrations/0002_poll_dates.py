@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('example', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='poll',
+            name='max_answers',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Max Answers'),
+        ),
+        migrations.AddField(
+            model_name='poll',
+            name='published_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Published At'),
+        ),
+        migrations.AddField(
+            model_name='poll',
+            name='start_date',
+            field=models.DateField(blank=True, null=True, verbose_name='Start Date'),
+        ),
+    ]
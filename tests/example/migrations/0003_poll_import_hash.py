@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('example', '0002_poll_dates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='poll',
+            name='import_hash',
+            field=models.CharField(blank=True, max_length=40, verbose_name='Import Hash'),
+        ),
+    ]
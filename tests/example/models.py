@@ -19,6 +19,18 @@ class Poll(models.Model):
         verbose_name=_("Poll Categories"),
         related_name="polls"
     )
+    start_date = models.DateField(
+        _("Start Date"), null=True, blank=True
+    )
+    published_at = models.DateTimeField(
+        _("Published At"), null=True, blank=True
+    )
+    max_answers = models.PositiveIntegerField(
+        _("Max Answers"), null=True, blank=True
+    )
+    import_hash = models.CharField(
+        _("Import Hash"), max_length=40, blank=True
+    )
 
     class Meta:
         """Poll Meta."""
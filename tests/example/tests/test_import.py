@@ -1,13 +1,74 @@
+import bz2
+import datetime
+import gzip
+import io
 import os
+import tempfile
+import zipfile
+from unittest import skipIf, skipUnless
 
+import pandas as pd
+from asgiref.sync import async_to_sync
 from django.apps import apps
 from django.conf import settings
 from django.core.files.base import ContentFile
-from django.test.testcases import TestCase
+from django.core.files.storage import FileSystemStorage
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, connection, models, transaction
+from django.test.utils import CaptureQueriesContext
+from django.test.testcases import TestCase, TransactionTestCase
 
+from tests.example.benchmark import run_benchmark, write_poll_file
 from tests.example.factories import PollFactory, UserFactory, PollCategoryFactory, QuestionFactory
 from tests.example.importer import PollsImporter
-from tests.example.models import Poll, Question
+from django_model_importer import signals
+from django_model_importer.checkpoints import FileCheckpoint
+from django_model_importer.converters import convert_datetime_series, convert_numeric_series
+from django_model_importer.metrics import MetricsCollector
+from django_model_importer.parallel import import_batches_in_parallel, partition_rows
+from django_model_importer.resolvers import RelatedObjectResolver
+from django_model_importer.writers import CopyWriter
+from tests.example.models import Poll, PollCategory, Question
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+class PollsUpsertImporter(PollsImporter):
+    can_update = True
+
+    db_mapping = {
+        "Titolo": "title",
+        "Categoria": "poll_categories.name",
+    }
+
+    def get_import_id(self, columns):
+        return columns["Titolo"]
+
+    def get_import_id_field_name(self):
+        return "title"
+
+
+class ParentCategoriesImporter(PollsUpsertImporter):
+    """ Only the process importing the tests creates categories, not its workers"""
+    parent_pid = os.getpid()
+
+    def can_add_m2m_object(self, m2m_model, value=""):
+        return os.getpid() == self.parent_pid
+
+
+class PollsScheduleImporter(PollsUpsertImporter):
+    date_format = "%d/%m/%Y"
+
+    db_mapping = {
+        "Titolo": "title",
+        "Inizio": "start_date",
+        "Pubblicazione": "published_at",
+        "Risposte": "max_answers",
+    }
 
 
 class PollImportUnitTest(TestCase):
@@ -52,3 +113,697 @@ class PollImportUnitTest(TestCase):
         self.assertTrue(
             Question.objects.get(text="Why you are writing?")
         )
+
+    def write_csv(self, csv_text, suffix=".csv"):
+        fd, file_name = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(fd, "w") as csv_file:
+            csv_file.write(csv_text)
+        self.addCleanup(os.remove, file_name)
+        return file_name
+
+    def test_poll_import_in_batches(self):
+        PollCategoryFactory(name="First")
+        file_name = self.write_csv(
+            "Titolo;Categoria\nTest Title;First\nTest Title;Second\nNew Title;Third")
+        result = PollsUpsertImporter().import_csv(file_name, batch_size=2)
+        self.assertEqual(result, {'rows': 3, 'imported': 3, 'errors': 0})
+        self.assertEqual(Poll.objects.count(), 2)
+        self.assertEqual(
+            set(Poll.objects.get(title="Test Title").poll_categories.values_list("name", flat=True)),
+            {"First", "Second"}
+        )
+        self.assertEqual(
+            list(Poll.objects.get(title="New Title").poll_categories.values_list("name", flat=True)),
+            ["Third"]
+        )
+        self.assertEqual(PollCategory.objects.count(), 3)
+
+    def test_import_id_lookups_are_prefetched(self):
+        PollFactory(title="First Title")
+        PollFactory(title="Second Title")
+        file_name = self.write_csv(
+            "Titolo;Categoria\nFirst Title;\nSecond Title;\nThird Title;\nThird Title;")
+        with CaptureQueriesContext(connection) as queries:
+            result = PollsUpsertImporter().import_csv(file_name)
+        self.assertEqual(result, {'rows': 4, 'imported': 4, 'errors': 0})
+        selects = [query for query in queries.captured_queries if query['sql'].startswith('SELECT')]
+        self.assertEqual(len(selects), 1)
+        self.assertEqual(Poll.objects.filter(title="Third Title").count(), 1)
+
+    def test_fk_values_are_resolved_in_bulk(self):
+        UserFactory(username="pippo")
+        file_name = self.write_csv("Titolo;Utente\n" + "\n".join(
+            "Title {0};{1}".format(index, ["pippo", "pluto", "paperino"][index % 3]) for index in range(30)))
+        User = apps.get_model(settings.AUTH_USER_MODEL)
+        with CaptureQueriesContext(connection) as queries:
+            result = PollsImporter().import_csv(file_name, batch_size=10)
+        self.assertEqual(result, {'rows': 30, 'imported': 30, 'errors': 0})
+        user_selects = [query for query in queries.captured_queries
+                        if query['sql'].startswith('SELECT') and User._meta.db_table in query['sql']]
+        # One lookup in the first batch and one reload of the created users
+        self.assertEqual(len(user_selects), 2)
+        self.assertEqual(Poll.objects.filter(user__username="pluto").count(), 10)
+        self.assertEqual(User.objects.filter(username__in=["pluto", "paperino"]).count(), 2)
+
+    def test_related_resolver_evicts_least_recently_used(self):
+        User = apps.get_model(settings.AUTH_USER_MODEL)
+        for username in ["pippo", "pluto", "paperino"]:
+            UserFactory(username=username)
+        resolver = RelatedObjectResolver(User, "username", max_size=2)
+        resolver.prefetch(["pippo", "pluto"])
+        resolver.resolve("pippo")
+        with self.assertNumQueries(1):
+            resolver.resolve("paperino")
+        self.assertEqual(list(resolver.objects), ["pippo", "paperino"])
+
+    def test_m2m_tokens_are_resolved_and_linked_in_bulk(self):
+        PollCategoryFactory(name="First")
+        file_name = self.write_csv("Titolo;Categoria\n" + "\n".join(
+            "Title {0};First | Second|Third{1}".format(index, index % 2) for index in range(20)))
+        through_table = Poll.poll_categories.through._meta.db_table
+        with CaptureQueriesContext(connection) as queries:
+            result = PollsUpsertImporter().import_csv(file_name, batch_size=20)
+        self.assertEqual(result, {'rows': 20, 'imported': 20, 'errors': 0})
+        category_selects = [query for query in queries.captured_queries
+                            if query['sql'].startswith('SELECT') and PollCategory._meta.db_table in query['sql']]
+        through_inserts = [query for query in queries.captured_queries
+                           if query['sql'].startswith('INSERT') and through_table in query['sql']]
+        # One lookup of the distinct tokens and one reload of the created categories
+        self.assertEqual(len(category_selects), 2)
+        self.assertEqual(len(through_inserts), 1)
+        self.assertEqual(PollCategory.objects.count(), 4)
+        self.assertEqual(
+            set(Poll.objects.get(title="Title 3").poll_categories.values_list("name", flat=True)),
+            {"First", "Second", "Third1"}
+        )
+
+    def test_poll_import_in_chunks(self):
+        file_name = self.write_csv("Titolo;Categoria\n" + "\n".join(
+            "Title {0};First".format(index) for index in range(5)))
+        importer = PollsUpsertImporter()
+        batches = []
+        importer.prepare_batch = lambda rows, prepare_batch=importer.prepare_batch: (
+            batches.append(len(rows)), prepare_batch(rows))
+        result = importer.import_csv(file_name, chunk_size=2)
+        self.assertEqual(result, {'rows': 5, 'imported': 5, 'errors': 0})
+        self.assertEqual(batches, [2, 2, 1])
+        self.assertEqual(Poll.objects.filter(poll_categories__name="First").count(), 5)
+        # Batches span the chunks
+        self.assertEqual(list(map(len, importer.iter_batches(file_name, batch_size=3, chunk_size=2))), [3, 2])
+        self.assertEqual(list(map(len, importer.iter_batches(file_name, batch_size=2, chunk_size=3))), [2, 2, 1])
+
+    def test_from_row_counts_the_data_rows(self):
+        # Blank lines and multiline cells are not rows
+        file_name = self.write_csv('Titolo;Categoria\nA;First\n\n"B\nb";First\nC;First\nD;First\n')
+        importer = PollsUpsertImporter()
+        for chunk_size in [None, 1, 2]:
+            data_frames = importer.get_data_frames(file_name, chunk_size=chunk_size, from_row=3)
+            self.assertEqual([title for data_frame in data_frames for title in data_frame["Titolo"]], ["C", "D"])
+        self.assertEqual(importer.import_csv(file_name, from_row=4), {'rows': 4, 'imported': 1, 'errors': 0})
+        self.assertEqual(list(Poll.objects.values_list("title", flat=True)), ["D"])
+
+    def test_field_plan_is_compiled_once_per_header(self):
+        importer = PollsImporter()
+        columns = ["Titolo", "Utente", "Categoria", "Domanda", "Unmapped"]
+        plan = importer.get_field_plan(columns)
+        self.assertEqual(
+            [(column_plan.column_name, column_plan.field_name, column_plan.kind) for column_plan in plan],
+            [("Titolo", "title", "value"), ("Utente", "user", "fk"), ("Categoria", "poll_categories", "m2m"),
+             ("Domanda", "questions", "children")]
+        )
+        self.assertIs(importer.get_field_plan(columns), plan)
+
+    def test_date_and_numeric_columns_are_converted_per_column(self):
+        file_name = self.write_csv(
+            "Titolo;Inizio;Pubblicazione;Risposte\n"
+            "First;02/01/2021;2021-01-02 10:30:00;10\n"
+            "Second;2021-01-02;2021-01-03 11:00:00;5\n"
+            "Third;03/01/2021;not a date;\n"
+            "Fourth;;;2.5\n"
+            "Fifth;04/01/2021;;7")
+        result = PollsScheduleImporter().import_csv(file_name)
+        self.assertEqual(result, {'rows': 5, 'imported': 2, 'errors': 3})
+        first_poll = Poll.objects.get(title="First")
+        self.assertEqual(first_poll.start_date, datetime.date(2021, 1, 2))
+        self.assertEqual(first_poll.published_at.replace(tzinfo=None), datetime.datetime(2021, 1, 2, 10, 30))
+        self.assertEqual(first_poll.max_answers, 10)
+        self.assertEqual(Poll.objects.get(title="Fifth").start_date, datetime.date(2021, 1, 4))
+        self.assertFalse(Poll.objects.filter(title__in=["Second", "Third", "Fourth"]).exists())
+
+    def test_converted_values_do_not_depend_on_the_other_cells(self):
+        for cells in [["02/01/2021", "13/01/2021"], ["13/01/2021", "02/01/2021"]]:
+            converted = dict(zip(cells, convert_datetime_series(pd.Series(cells, name="Inizio"), kind="date")))
+            self.assertEqual(converted["02/01/2021"], datetime.date(2021, 2, 1))
+            self.assertEqual(converted["13/01/2021"], datetime.date(2021, 1, 13))
+        self.assertEqual(
+            list(convert_numeric_series(pd.Series(["9007199254740993", "", "-12"], name="Id"), kind="int")),
+            [9007199254740993, "", -12]
+        )
+        # Timestamps across a DST change are converted cell by cell
+        file_name = self.write_csv(
+            "Titolo;Pubblicazione\n"
+            "First;2021-03-28 01:00:00+01:00\n"
+            "Second;2021-03-28 04:00:00+02:00\n"
+            "Third;not a date")
+        result = PollsScheduleImporter(continue_on_error=True).import_csv(file_name)
+        self.assertEqual(result, {'rows': 3, 'imported': 2, 'errors': 1})
+        self.assertEqual(
+            [poll.published_at.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+             for poll in Poll.objects.order_by("title")],
+            [datetime.datetime(2021, 3, 28, 0, 0), datetime.datetime(2021, 3, 28, 2, 0)]
+        )
+
+    def test_rows_with_the_same_import_id_share_a_partition(self):
+        numbered_rows = list(enumerate(
+            [{"Titolo": "Title {0}".format(index % 5), "Categoria": str(index)} for index in range(40)], start=1))
+        partitions = partition_rows(PollsUpsertImporter(), numbered_rows, 3)
+        self.assertEqual(sum(len(partition) for partition in partitions), 40)
+        for title in ["Title {0}".format(index) for index in range(5)]:
+            self.assertEqual(
+                len([partition for partition in partitions
+                     if any(row["Titolo"] == title for row_number, row in partition)]),
+                1
+            )
+        # Without import id the rows are spread round robin
+        partitions = partition_rows(PollsImporter(), numbered_rows, 3)
+        self.assertEqual([len(partition) for partition in partitions], [14, 13, 13])
+
+    def test_failing_rows_are_rolled_back_to_their_savepoint(self):
+        file_name = self.write_csv(
+            "Titolo;Risposte\nFirst;10\nSecond;-5\nThird;3")
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            PollsScheduleImporter().import_csv(file_name)
+        for batch_size in [None, 10]:
+            result = PollsScheduleImporter(transaction_mode="batch").import_csv(file_name, batch_size=batch_size)
+            self.assertEqual(result, {'rows': 3, 'imported': 2, 'errors': 1})
+            self.assertEqual(
+                sorted(Poll.objects.values_list("title", flat=True)),
+                ["First", "Third"]
+            )
+            Poll.objects.all().delete()
+
+    def test_failed_rows_do_not_leak_into_the_next_rows_of_their_object(self):
+        file_name = self.write_csv("Titolo;Risposte;Inizio\nA;10;\nA;-5;\nA;;01/02/2021\nB;3;\nB;-1;")
+        for options in [{'transaction_mode': "batch"}, {'continue_on_error': True}]:
+            for batch_size in [None, 10]:
+                result = PollsScheduleImporter(**options).import_csv(file_name, batch_size=batch_size)
+                self.assertEqual(result, {'rows': 5, 'imported': 3, 'errors': 2})
+                self.assertEqual(
+                    list(Poll.objects.order_by("title").values_list("title", "max_answers", "start_date")),
+                    [("A", 10, datetime.date(2021, 2, 1)), ("B", 3, None)]
+                )
+                Poll.objects.all().delete()
+
+        class FailingImporter(PollsScheduleImporter):
+            def set_model_attr(self, obj, _field_name, value):
+                super(FailingImporter, self).set_model_attr(obj, _field_name, value)
+                if value == 99:
+                    raise RuntimeError("Failed after changing the object")
+
+        file_name = self.write_csv("Titolo;Risposte;Inizio\nA;10;\nA;99;\nA;;01/02/2021")
+        result = FailingImporter(transaction_mode="batch").import_csv(file_name, batch_size=10)
+        self.assertEqual(result, {'rows': 3, 'imported': 2, 'errors': 1})
+        self.assertEqual(list(Poll.objects.values_list("title", "max_answers", "start_date")),
+                         [("A", 10, datetime.date(2021, 2, 1))])
+
+    def test_benchmark_reports_the_import_measures(self):
+        file_name = write_poll_file(self.write_csv(""), rows=30, users=5, categories=4, extra_columns=3)
+        run = run_benchmark(file_name, existing_users=2, import_kwargs={"batch_size": 10})
+        self.assertEqual(run["result"], {'rows': 30, 'imported': 30, 'errors': 0})
+        self.assertEqual(set(run["phases"]), {"read", "convert", "resolve", "rows", "write"})
+        self.assertGreater(run["queries"], 0)
+        self.assertGreater(run["peak_memory"], 0)
+        # Rolled back unless keep is set
+        self.assertEqual(Poll.objects.count(), 0)
+
+    def test_import_metrics_are_collected_per_phase(self):
+        file_name = self.write_csv("Titolo;Utente\n" + "\n".join(
+            "Title {0};user{1}".format(index, index % 3) for index in range(10)))
+        collector = MetricsCollector()
+        finished_phases = []
+
+        def phase_finished(sender, phase, **kwargs):
+            finished_phases.append(phase)
+
+        signals.import_phase_finished.connect(phase_finished)
+        self.addCleanup(signals.import_phase_finished.disconnect, phase_finished)
+        result = PollsImporter().import_csv(file_name, batch_size=5, metrics_sink=collector, profile=True)
+        metrics = result.pop('metrics')
+        self.assertEqual(result, {'rows': 10, 'imported': 10, 'errors': 0})
+        self.assertEqual(set(metrics['phases']), {"read", "convert", "resolve", "rows", "write"})
+        self.assertEqual(metrics['phases']['resolve']['calls'], 2)
+        self.assertEqual(metrics['queries'], sum(phase['queries'] for phase in metrics['phases'].values()))
+        self.assertIn("cumulative", metrics['profile'])
+        self.assertEqual(finished_phases.count("write"), 2)
+        self.assertEqual(collector.total("django_model_importer.imported"), 10)
+        self.assertEqual(len(collector.samples["django_model_importer.rows.time"]), 2)
+        # Without metrics the result is unchanged
+        self.assertNotIn('metrics', PollsImporter().import_csv(file_name))
+
+    def test_rows_are_traced_only_when_sampled(self):
+        file_name = self.write_csv("Titolo;Utente\n" + "\n".join(
+            "Title {0};user{1}".format(index, index % 3) for index in range(10)))
+        with self.assertLogs(PollsImporter.logger, level="DEBUG") as logs:
+            PollsImporter().import_csv(file_name, batch_size=5, trace_rows_every=4)
+        row_records = [record for record in logs.records if hasattr(record, 'import_row')]
+        self.assertEqual([record.import_row['row_number'] for record in row_records], [1, 5, 9])
+        batch_records = [record for record in logs.records if hasattr(record, 'import_batch')]
+        self.assertEqual([record.import_batch['last_row'] for record in batch_records], [5, 10])
+        self.assertFalse([record for record in logs.records if "Setting attr" in record.getMessage()])
+        # Without sampling the tracer is never called
+        with self.assertLogs(PollsImporter.logger, level="DEBUG") as logs:
+            PollsImporter().import_csv(file_name, batch_size=5)
+        self.assertFalse([record for record in logs.records if hasattr(record, 'import_row')])
+
+    def test_copy_writer_falls_back_to_bulk_writes(self):
+        existing_poll = PollFactory(title="Existing", max_answers=1)
+        file_name = self.write_csv("Titolo;Inizio;Pubblicazione;Risposte\n"
+                                   "Existing;01/02/2021;;3\n"
+                                   "New;;;5\n")
+        importer = PollsScheduleImporter(writer_class=CopyWriter)
+        with CaptureQueriesContext(connection) as queries:
+            result = importer.import_csv(file_name, batch_size=10)
+        self.assertEqual(result, {'rows': 2, 'imported': 2, 'errors': 0})
+        self.assertFalse([query for query in queries.captured_queries if "COPY" in query['sql']])
+        existing_poll.refresh_from_db()
+        self.assertEqual((existing_poll.max_answers, existing_poll.start_date), (3, datetime.date(2021, 2, 1)))
+        self.assertEqual(Poll.objects.get(title="New").max_answers, 5)
+        writer = CopyWriter(Poll, using="default")
+        self.assertFalse(writer.is_supported())
+        self.assertEqual([writer.get_copy_value(value) for value in [None, True, 3, "a\tb\\c\n"]],
+                         ["\\N", "t", "3", "a\\tb\\\\c\\n"])
+        # Only scalar values are formatted as COPY text
+        self.assertTrue(all(writer.is_text_field(field) for field in Poll._meta.concrete_fields))
+        self.assertFalse(writer.is_text_field(models.BinaryField()))
+        self.assertFalse(writer.is_text_field(models.JSONField()))
+
+    @skipUnless(connection.vendor == "postgresql", "COPY needs PostgreSQL")
+    def test_copy_writer_copies_and_merges_the_rows(self):
+        existing_poll = PollFactory(title="Existing", max_answers=1)
+        file_name = self.write_csv("Titolo;Inizio;Pubblicazione;Risposte\n"
+                                   "Existing;01/02/2021;;3\n"
+                                   "New\twith\\tab;;02/02/2021 10:30;5\n")
+        result = PollsScheduleImporter(writer_class=CopyWriter).import_csv(file_name, batch_size=10)
+        self.assertEqual(result, {'rows': 2, 'imported': 2, 'errors': 0})
+        existing_poll.refresh_from_db()
+        self.assertEqual((existing_poll.max_answers, existing_poll.start_date), (3, datetime.date(2021, 2, 1)))
+        new_poll = Poll.objects.get(title="New\twith\\tab")
+        self.assertEqual((new_poll.max_answers, new_poll.published_at.minute), (5, 30))
+        # Merged on the unique username
+        User = apps.get_model(settings.AUTH_USER_MODEL)
+        UserFactory(username="pippo", first_name="Old")
+        CopyWriter(User, using="default").write(
+            [User(username="pluto", password="!")], [User(username="pippo", password="!", first_name="New")],
+            ["first_name"], conflict_field="username")
+        self.assertEqual(dict(User.objects.values_list("username", "first_name")), {"pippo": "New", "pluto": ""})
+
+    def test_unchanged_rows_are_not_written(self):
+        PollFactory(title="Same", max_answers=1, start_date=datetime.date(2021, 2, 1))
+        changed_poll = PollFactory(title="Changed", max_answers=2, start_date=datetime.date(2021, 2, 1))
+        file_name = self.write_csv("Titolo;Inizio;Risposte\n"
+                                   "Same;01/02/2021;1\n"
+                                   "Changed;01/02/2021;5\n")
+        for batch_size in [None, 10]:
+            importer = PollsScheduleImporter(batch_size=batch_size, skip_unchanged=True)
+            with CaptureQueriesContext(connection) as queries:
+                result = importer.import_csv(file_name)
+            self.assertEqual(result, {'rows': 2, 'imported': 2, 'errors': 0})
+            updates = [query['sql'] for query in queries.captured_queries if query['sql'].startswith("UPDATE")]
+            self.assertEqual(len(updates), 1)
+            self.assertIn('"max_answers"', updates[0])
+            self.assertNotIn('"start_date"', updates[0])
+            changed_poll.refresh_from_db()
+            self.assertEqual(changed_poll.max_answers, 5)
+            changed_poll.max_answers = 2
+            changed_poll.save()
+
+    def test_rows_with_the_same_content_hash_are_skipped(self):
+        file_name = self.write_csv("Titolo;Inizio;Risposte\n"
+                                   "First;01/02/2021;1\n"
+                                   "Second;01/02/2021;2\n")
+        importer = PollsScheduleImporter(batch_size=10, skip_unchanged=True, content_hash_field="import_hash")
+        importer.import_csv(file_name)
+        self.assertEqual(len(Poll.objects.get(title="First").import_hash), 40)
+        with CaptureQueriesContext(connection) as queries:
+            result = importer.import_csv(file_name)
+        self.assertEqual(result, {'rows': 2, 'imported': 2, 'errors': 0})
+        # Only the stored hashes are read
+        self.assertEqual(len(queries.captured_queries), 1)
+        self.assertIn('"import_hash"', queries.captured_queries[0]['sql'])
+
+    def test_rows_repeating_an_import_id_are_hashed_together(self):
+        importer = PollsScheduleImporter(batch_size=10, skip_unchanged=True, content_hash_field="import_hash")
+        importer.import_csv(self.write_csv("Titolo;Risposte\nA;1\nA;2\n"))
+        self.assertEqual(Poll.objects.get(title="A").max_answers, 2)
+        importer.merge_policy = "first"
+        result = importer.import_csv(self.write_csv("Titolo;Risposte\nA;9\nA;2\n"))
+        self.assertEqual(result, {'rows': 2, 'imported': 2, 'errors': 0})
+        self.assertEqual(Poll.objects.get(title="A").max_answers, 9)
+
+    def test_model_options_are_set_by_init_and_reach_the_workers(self):
+        importer = PollsImporter(skip_unchanged=True, merge_policy="first", writer_class=CopyWriter)
+        self.assertEqual((importer.skip_unchanged, importer.merge_policy, importer.writer_class),
+                         (True, "first", CopyWriter))
+        importer.content_hash_field = "import_hash"
+        worker_importer = PollsImporter(**importer.get_worker_init_kwargs())
+        self.assertEqual((worker_importer.skip_unchanged, worker_importer.merge_policy,
+                          worker_importer.content_hash_field), (True, "first", "import_hash"))
+
+    def test_async_import_yields_the_progress_events(self):
+        file_name = self.write_csv("Titolo;Utente\n" + "\n".join(
+            "Title {0};user{1}".format(index, index % 3) for index in range(5)))
+
+        async def import_file():
+            return [event async for event in PollsImporter().aimport_csv(file_name, batch_size=2)]
+
+        events = async_to_sync(import_file)()
+        self.assertEqual([event['rows'] for event in events if event['event'] == 'progress'], [2, 4, 5])
+        self.assertEqual(events[-1], {'event': 'finished', 'result': {'rows': 5, 'imported': 5, 'errors': 0}})
+        self.assertEqual(Poll.objects.count(), 5)
+
+    def test_only_the_mapped_columns_are_read(self):
+        file_name = write_poll_file(self.write_csv(""), rows=4, users=2, extra_columns=5)
+        importer = PollsImporter(read_mapped_columns_only=True)
+        data_frame = next(importer.get_data_frames(file_name))
+        self.assertEqual(list(data_frame.columns), ["Titolo", "Utente", "Categoria", "Domanda"])
+        self.assertIsInstance(data_frame["Utente"].dtype, pd.CategoricalDtype)
+        self.assertEqual(importer.get_data_frame_as_dict(data_frame)[0]["Utente"], "user0")
+        importer.db_mapping = dict(importer.db_mapping, Missing="title")
+        self.assertEqual(importer.get_usecols(engine="pyarrow")[-1], "Missing")
+        PollsUpsertImporter(csv_engine="python").import_csv(file_name, chunk_size=2)
+        self.assertEqual(Poll.objects.count(), 4)
+
+    @skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_pyarrow_engine_reads_the_mapped_columns_of_the_file(self):
+        file_name = self.write_csv("Titolo;Utente;Extra\nFirst;pippo;x\nSecond;pluto;y\n")
+        importer = PollsImporter(csv_engine="pyarrow", read_mapped_columns_only=True)
+        self.assertEqual(importer.get_read_kwargs("csv", import_file=importer.get_import_file(file_name))['engine'],
+                         "pyarrow")
+        # Categoria and Domanda are mapped but missing from the file
+        data_frame = next(importer.get_data_frames(file_name))
+        self.assertEqual(list(data_frame.columns), ["Titolo", "Utente"])
+        self.assertEqual(importer.import_csv(file_name), {'rows': 2, 'imported': 2, 'errors': 0})
+        self.assertEqual(Poll.objects.get(title="Second").user.username, "pluto")
+        # A stream read once falls back to the C engine
+        stream = io.BytesIO(b"Titolo;Utente;Extra\nThird;pippo;z\n")
+        stream.name, stream.seekable = "polls.csv", lambda: False
+        self.assertNotIn("engine", importer.get_read_kwargs("csv", import_file=importer.get_import_file(stream)))
+        self.assertEqual(list(next(importer.get_data_frames(stream)).columns), ["Titolo", "Utente"])
+
+    @skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_parquet_and_feather_files_keep_their_types(self):
+        data_frame = pd.DataFrame({
+            "Titolo": ["First", "Second", "Third"],
+            "Inizio": [datetime.date(2021, 2, 1), None, datetime.date(2021, 3, 1)],
+            "Pubblicazione": pd.to_datetime(["2021-01-01 10:30", None, "2021-01-02 08:00"]),
+            "Risposte": [3, None, 5],
+            "Extra": ["a", "b", "c"],
+        })
+        parquet_file_name = self.write_csv("", suffix=".parquet")
+        data_frame.to_parquet(parquet_file_name, row_group_size=2)
+        importer = PollsScheduleImporter()
+        self.assertEqual([len(frame) for frame in importer.get_data_frames(parquet_file_name)], [2, 1])
+        result = importer.import_csv(parquet_file_name, batch_size=10)
+        self.assertEqual(result, {'rows': 3, 'imported': 3, 'errors': 0})
+        first_poll = Poll.objects.get(title="First")
+        self.assertEqual((first_poll.start_date, first_poll.max_answers), (datetime.date(2021, 2, 1), 3))
+        self.assertEqual(first_poll.published_at.minute, 30)
+        self.assertIsNone(Poll.objects.get(title="Second").start_date)
+        Poll.objects.all().delete()
+        feather_file_name = self.write_csv("", suffix=".feather")
+        data_frame.to_feather(feather_file_name)
+        importer.read_mapped_columns_only = True
+        self.assertNotIn("Extra", next(importer.get_data_frames(feather_file_name)).columns)
+        result = importer.import_csv(feather_file_name, from_row=3)
+        self.assertEqual(result, {'rows': 3, 'imported': 1, 'errors': 0})
+        self.assertEqual(Poll.objects.get().max_answers, 5)
+
+    def test_xlsx_files_are_streamed_in_chunks(self):
+        file_name = write_poll_file(self.write_csv("", suffix=".xlsx"), file_format="xlsx", rows=7, users=3)
+        importer = PollsUpsertImporter()
+        streamed_frames = list(importer.get_data_frames(file_name, chunk_size=3))
+        self.assertEqual([len(data_frame) for data_frame in streamed_frames], [3, 3, 1])
+        streamed_rows = [row for data_frame in streamed_frames for row in importer.get_data_frame_as_dict(data_frame)]
+        loaded_rows = importer.get_data_frame_as_dict(importer.get_rows_as_data_frame(file_name))
+        self.assertEqual(streamed_rows, loaded_rows)
+        self.assertEqual(len(next(importer.get_data_frames(file_name, chunk_size=3, from_row=7))), 1)
+        result = importer.import_csv(file_name, chunk_size=3, batch_size=2)
+        self.assertEqual(result, {'rows': 7, 'imported': 7, 'errors': 0})
+
+    def test_compressed_files_and_file_objects_are_streamed(self):
+        csv_text = "Titolo;Utente\n" + "\n".join("Title {0};user{0}".format(index) for index in range(3))
+        gzip_file_name = self.write_csv("", suffix=".csv.gz")
+        with gzip.open(gzip_file_name, "wt") as gzip_file:
+            gzip_file.write(csv_text)
+        self.assertEqual(PollsImporter().import_csv(gzip_file_name, chunk_size=2)['imported'], 3)
+        # Without a usable name the compression and the format are sniffed
+        upload = SimpleUploadedFile("upload", bz2.compress(csv_text.encode("utf-8")))
+        self.assertEqual(PollsImporter().get_import_file(upload).compression, "bz2")
+        self.assertEqual(PollsImporter().import_csv(upload)['imported'], 3)
+        zip_buffer = io.BytesIO()
+        with zipfile.ZipFile(zip_buffer, "w") as archive:
+            archive.writestr("polls.csv", csv_text)
+        self.assertEqual(PollsImporter().import_csv(ContentFile(zip_buffer.getvalue(), name="polls.zip"))['rows'], 3)
+        storage = FileSystemStorage(location=os.path.dirname(gzip_file_name))
+        result = PollsImporter(storage=storage).import_csv(os.path.basename(gzip_file_name))
+        self.assertEqual(result, {'rows': 3, 'imported': 3, 'errors': 0})
+        self.assertEqual(Poll.objects.count(), 12)
+        xlsx_file_name = write_poll_file(self.write_csv("", suffix=".xlsx"), file_format="xlsx", rows=2)
+        with open(xlsx_file_name, "rb") as xlsx_file:
+            self.assertEqual(PollsImporter().get_import_file(SimpleUploadedFile("upload", xlsx_file.read()))
+                             .file_extension, "xlsx")
+
+    def test_non_seekable_and_text_streams_are_read(self):
+        csv_text = "Titolo;Utente\n" + "\n".join("Title {0};user{0}".format(index) for index in range(3))
+
+        class Pipe(io.BytesIO):
+            def seekable(self):
+                return False
+
+            def seek(self, *args):
+                raise io.UnsupportedOperation("seek")
+
+        feed = Pipe(gzip.compress(csv_text.encode("utf-8")))
+        feed.name = "feed.csv.gz"
+        self.assertEqual(PollsImporter().import_csv(feed)['imported'], 3)
+        # Without a usable name the stream is spooled to sniff it
+        self.assertEqual(PollsImporter().import_csv(Pipe(bz2.compress(csv_text.encode("utf-8"))))['rows'], 3)
+        self.assertEqual(PollsImporter().import_csv(io.StringIO(csv_text))['rows'], 3)
+        # Zip archives and Excel files are read at random, they are spooled too
+        zip_buffer = io.BytesIO()
+        with zipfile.ZipFile(zip_buffer, "w") as archive:
+            archive.writestr("polls.csv", csv_text)
+        feed = Pipe(zip_buffer.getvalue())
+        feed.name = "feed.csv.zip"
+        self.assertEqual(PollsImporter().import_csv(feed)['rows'], 3)
+        xlsx_file_name = write_poll_file(self.write_csv("", suffix=".xlsx"), file_format="xlsx", rows=2)
+        with open(xlsx_file_name, "rb") as xlsx_file:
+            feed = Pipe(xlsx_file.read())
+        feed.name = "feed.xlsx"
+        self.assertEqual(PollsImporter().import_csv(feed, chunk_size=1)['rows'], 2)
+        self.assertEqual(PollsImporter().import_csv(ContentFile(csv_text, name="polls.csv"))['rows'], 3)
+
+    def test_reverse_fk_children_are_created_in_bulk(self):
+        file_name = self.write_csv("Titolo;Domanda\n" + "\n".join(
+            "Poll {0};Question {1}".format(index // 3, index) for index in range(9)))
+        importer = PollsUpsertImporter()
+        importer.db_mapping = {"Titolo": "title", "Domanda": "questions__text"}
+        with CaptureQueriesContext(connection) as queries:
+            result = importer.import_csv(file_name, batch_size=9)
+        self.assertEqual(result, {'rows': 9, 'imported': 9, 'errors': 0})
+        self.assertEqual(Poll.objects.count(), 3)
+        self.assertEqual(
+            list(Poll.objects.get(title="Poll 1").questions.order_by("text").values_list("text", flat=True)),
+            ["Question 3", "Question 4", "Question 5"]
+        )
+        question_inserts = [query for query in queries.captured_queries
+                            if query['sql'].startswith('INSERT INTO "example_question"')]
+        self.assertEqual(len(question_inserts), 1)
+
+    def test_reimported_children_are_not_duplicated(self):
+        importer = PollsUpsertImporter()
+        importer.db_mapping = {"Titolo": "title", "Domanda": "questions__text"}
+        file_name = self.write_csv("Titolo;Domanda\nPoll;Question 1\nPoll;Question 2\nPoll;Question 1")
+        for batch_size in [None, 10, None]:
+            importer.import_csv(file_name, batch_size=batch_size)
+            self.assertEqual(Question.objects.count(), 2)
+        importer.import_csv(self.write_csv("Titolo;Domanda\nPoll;Question 3"))
+        self.assertEqual(sorted(Question.objects.values_list("text", flat=True)),
+                         ["Question 1", "Question 2", "Question 3"])
+        importer.child_match_fields = {"questions": []}
+        importer.import_csv(file_name, batch_size=10)
+        self.assertEqual(Question.objects.count(), 6)
+
+    def test_countries_are_looked_up_in_a_normalized_index(self):
+        importer = PollsImporter()
+        poll = Poll(title="Countries")
+        for value, code in [("italy", "IT"), ("  CÔTE d'IVOIRE ", "CI"), ("DEU", "DE"), ("fr", "FR"), ("USA", "US")]:
+            importer.process_django_countries_field(poll, "country", value)
+            self.assertEqual(poll.country, code)
+        self.assertIs(importer.get_country_index(), PollsImporter().get_country_index())
+        with self.assertLogs("django_model_importer.controllers", "WARNING") as logs:
+            importer.process_django_countries_field(poll, "country", "Atlantis")
+            importer.process_django_countries_field(poll, "country", "Atlantis")
+        self.assertEqual(len(logs.output), 1)
+        self.assertEqual(poll.country, "US")
+
+    def test_dry_run_validates_the_rows_without_writing(self):
+        UserFactory(username="pippo")
+        file_name = self.write_csv("\n".join([
+            "Titolo;Utente;Categoria;Risposte;Data",
+            "Valid;pippo;First|Second;3;2021-01-01",
+            ";pluto;First;4;2021-01-02",
+            "{0};pippo;;1;2021-01-03".format("x" * 300),
+            "Bad date;paperino;Second;5;not a date",
+        ] + ["Poll {0};user{0};Third;1;2021-01-04".format(index) for index in range(20)]))
+        importer = PollsImporter()
+        importer.db_mapping = dict(importer.db_mapping, Risposte="max_answers", Data="start_date")
+        User = apps.get_model(settings.AUTH_USER_MODEL)
+        with CaptureQueriesContext(connection) as queries:
+            result = importer.import_csv(file_name, dry_run=True, batch_size=100, transaction_mode="batch")
+        self.assertEqual(result['rows'], 24)
+        self.assertEqual(result['errors'], 3)
+        self.assertEqual(
+            [(row_error['row'], row_error['column'], row_error['value']) for row_error in result['row_errors']],
+            [(2, "Titolo", ""), (3, "Titolo", "x" * 300), (4, "Data", "not a date")]
+        )
+        self.assertFalse([query for query in queries.captured_queries
+                          if not query['sql'].startswith('SELECT')])
+        self.assertLessEqual(len(queries.captured_queries), 3)
+        self.assertEqual((Poll.objects.count(), PollCategory.objects.count(), User.objects.count()), (0, 0, 1))
+        self.assertNotIn('row_errors', importer.import_csv(file_name, batch_size=100))
+
+    def test_failing_rows_are_collected_and_rejected(self):
+        file_name = self.write_csv(
+            "Titolo;Inizio;Risposte\n"
+            "First;01/01/2021;10\n"
+            "Second;2021-01-02;5\n"
+            "Third;03/01/2021;-5\n"
+            "Fourth;04/01/2021;7\n"
+            "Fifth;05/01/2021;-1\n")
+        for batch_size in [None, 10]:
+            errors_file = self.write_csv("", suffix=".jsonl")
+            rejects_file = self.write_csv("")
+            importer = PollsScheduleImporter(continue_on_error=True, max_errors_in_memory=1)
+            result = importer.import_csv(file_name, batch_size=batch_size, errors_file=errors_file,
+                                         rejects_file=rejects_file)
+            self.assertEqual((result['rows'], result['imported'], result['errors']), (5, 2, 3))
+            row_errors = list(result['row_errors'])
+            self.assertEqual(
+                [(row_error['row'], row_error['column'], row_error['exception']) for row_error in row_errors],
+                [(2, "Inizio", "ValueError"), (3, None, "IntegrityError"), (5, None, "IntegrityError")]
+            )
+            self.assertEqual(row_errors[0]['value'], "2021-01-02")
+            with open(errors_file) as error_file:
+                self.assertEqual(len(error_file.readlines()), 3)
+            with open(rejects_file) as rejects:
+                self.assertEqual(rejects.read().splitlines(), [
+                    "Titolo;Inizio;Risposte", "Second;2021-01-02;5", "Third;03/01/2021;-5", "Fifth;05/01/2021;-1"])
+            self.assertEqual(sorted(Poll.objects.values_list("title", flat=True)), ["First", "Fourth"])
+            Poll.objects.all().delete()
+        # The rejects file is imported again as is
+        self.assertEqual(PollsScheduleImporter(continue_on_error=True).import_csv(rejects_file)['imported'], 0)
+        result = PollsScheduleImporter(continue_on_error=True, collect_errors=True).import_csv(file_name)
+        self.assertEqual(len(result['row_errors']), 3)
+        self.assertFalse(result['row_errors'].is_spilled)
+
+    def test_rows_repeating_an_import_id_are_merged(self):
+        file_name = self.write_csv(
+            "Titolo;Categoria;Risposte;Domanda\n"
+            "Title A;First;10;Question 1\n"
+            "Title A;Second;20;Question 2\n"
+            "Title A;First;;Question 3\n"
+            "Title B;First;5;Question 4\n")
+
+        class PollsMergeImporter(PollsUpsertImporter):
+            can_update = False
+            db_mapping = dict(PollsUpsertImporter.db_mapping, Risposte="max_answers", Domanda="questions__text")
+
+        for merge_policy, max_answers in [("first", 10), ("last", 20)]:
+            importer = PollsMergeImporter(merge_policy=merge_policy)
+            with CaptureQueriesContext(connection) as queries:
+                result = importer.import_csv(file_name, batch_size=10)
+            self.assertEqual(result, {'rows': 4, 'imported': 4, 'errors': 0})
+            poll = Poll.objects.get(title="Title A")
+            self.assertEqual(poll.max_answers, max_answers)
+            self.assertEqual(sorted(poll.poll_categories.values_list("name", flat=True)), ["First", "Second"])
+            self.assertEqual(poll.questions.count(), 3)
+            self.assertEqual(Poll.objects.count(), 2)
+            self.assertEqual(len([query for query in queries.captured_queries
+                                  if query['sql'].startswith(('INSERT INTO "example_poll"', 'UPDATE'))]), 2)
+            Poll.objects.all().delete()
+
+
+class TransactionalImportTest(TransactionTestCase):
+    write_csv = PollImportUnitTest.write_csv
+
+    def test_import_resumes_from_its_checkpoint(self):
+        file_name = self.write_csv("Titolo;Utente\n" + "\n".join(
+            "Title {0};user{0}".format(index) for index in range(6)))
+
+        class CrashingImporter(PollsImporter):
+            def process_row(self, **kwargs):
+                if kwargs['items']['Titolo'] == "Title 4":
+                    raise RuntimeError("Crash")
+                return super(CrashingImporter, self).process_row(**kwargs)
+
+        checkpoint = FileCheckpoint(file_name)
+        # Nothing is committed before the transaction of the caller
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            CrashingImporter().import_csv(file_name, batch_size=2, checkpoint=True)
+        self.assertIsNone(checkpoint.load())
+        self.assertEqual(Poll.objects.count(), 0)
+        with self.assertRaises(RuntimeError):
+            CrashingImporter().import_csv(file_name, batch_size=2, checkpoint=True)
+        self.assertEqual(checkpoint.load()['next_row'], 5)
+        self.assertEqual(Poll.objects.count(), 4)
+        result = PollsImporter().import_csv(file_name, batch_size=2, checkpoint=True)
+        self.assertEqual(result, {'rows': 6, 'imported': 6, 'errors': 0})
+        self.assertEqual(Poll.objects.filter(title__in=["Title 4", "Title 5"]).count(), 2)
+        self.assertEqual(Poll.objects.count(), 6)
+        self.assertIsNone(checkpoint.load())
+        # from_row skips the first rows without any checkpoint
+        Poll.objects.all().delete()
+        self.assertEqual(PollsImporter().import_csv(file_name, from_row=6)['imported'], 1)
+        self.assertEqual(list(Poll.objects.values_list("title", flat=True)), ["Title 5"])
+
+    def test_chunks_crashing_midway_are_not_imported_twice(self):
+        file_name = self.write_csv("Titolo;Utente\n" + "\n".join(
+            "Title {0};user{0}".format(index) for index in range(6)))
+
+        class CrashingImporter(PollsImporter):
+            def process_row(self, **kwargs):
+                if kwargs['items']['Titolo'] == "Title 4":
+                    raise RuntimeError("Crash")
+                return super(CrashingImporter, self).process_row(**kwargs)
+
+        # Rows are autocommitted one at a time, except in a checkpointed chunk
+        with self.assertRaises(RuntimeError):
+            CrashingImporter().import_csv(file_name, chunk_size=3, checkpoint=True)
+        self.assertEqual(FileCheckpoint(file_name).load()['next_row'], 4)
+        self.assertEqual(Poll.objects.count(), 3)
+        self.assertEqual(PollsImporter().import_csv(file_name, chunk_size=3, checkpoint=True)['imported'], 6)
+        self.assertEqual(sorted(Poll.objects.values_list("title", flat=True)),
+                         ["Title {0}".format(index) for index in range(6)])
+
+    def test_import_with_workers_creates_the_shared_related_objects_once(self):
+        file_name = self.write_csv("Titolo;Categoria\n" + "\n".join(
+            "Title {0};First|Second{1}".format(index, index % 3) for index in range(24)))
+        result = ParentCategoriesImporter(workers_start_method="fork").import_csv(file_name, workers=2, batch_size=6)
+        self.assertEqual(result, {'rows': 24, 'imported': 24, 'errors': 0})
+        self.assertEqual(Poll.objects.count(), 24)
+        self.assertEqual(sorted(PollCategory.objects.values_list("name", flat=True)),
+                         ["First", "Second0", "Second1", "Second2"])
+        self.assertEqual(Poll.poll_categories.through.objects.count(), 48)
+
+    def test_batches_are_imported_by_worker_processes(self):
+        rows = [{"Titolo": "Title {0}".format(index), "Risposte": -5 if index == 3 else index} for index in range(10)]
+        batches = [rows[:4], rows[4:8], rows[8:]]
+        importer = PollsScheduleImporter(workers_start_method="fork")
+        with self.assertRaises(ImproperlyConfigured), transaction.atomic():
+            import_batches_in_parallel(importer, iter(batches), workers=1, batch_size=4)
+        # Set by import_csv(continue_on_error=True), it reaches the workers
+        importer.continue_on_error = True
+        self.assertEqual(import_batches_in_parallel(importer, iter(batches), workers=1, batch_size=4), (10, 9, 1))
+        self.assertEqual(Poll.objects.count(), 9)
+        self.assertFalse(Poll.objects.filter(title="Title 3").exists())